@@ -0,0 +1,147 @@
+import re
+
+# Opcodes which push a return address and jump (CALL, CALL cc, RST),
+# and which pop one (RET, RET cc, RETI)
+CALLS = {0xCD, 0xC4, 0xCC, 0xD4, 0xDC} | set(range(0xC7, 0x100, 8))
+RETS = {0xC9, 0xC0, 0xC8, 0xD0, 0xD8, 0xD9}
+
+# Stands in for a function at the top of the stack while the CPU is halted
+HALTED = -1
+
+SYM_LINE = re.compile(r"^\s*([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,4})\s+(\S+)")
+
+
+def load_sym(path):
+    """
+    Read an RGBDS / no$gmb style symbol file, with lines like
+    "01:4A2F DrawSprite" (bank:address name) and ; comments,
+    into {bank << 16 | address: name}
+    """
+    symbols = {}
+    with open(path) as fp:
+        for line in fp:
+            match = SYM_LINE.match(line.split(";")[0])
+            if match:
+                bank, addr, name = match.groups()
+                symbols[int(bank, 16) << 16 | int(addr, 16)] = name
+    return symbols
+
+
+def bank_of(addr):
+    # Which ROM bank `addr` is in, for carts without bank switching:
+    # 0x4000-0x7FFF is always bank 1, and everything else counts as 0
+    return 1 if 0x4000 <= addr < 0x8000 else 0
+
+
+class CallGraph:
+    """
+    A shadow of the guest's call stack, built by watching calls and
+    returns (including interrupts), which counts the cycles spent with
+    each distinct stack of functions.
+
+    Returns are matched up by SP rather than by counting, so code which
+    drops its return address and jumps elsewhere gets unwound by the
+    next return from further up the stack. Functions are told apart by
+    bank as well as address, using `bank_of(addr)` (usually the MBC's).
+
+    >>> g = CallGraph({0x0150: "main", 0x0200: "draw"})
+    >>> g.step(0x00, 0xFFFE, 0xFFFE, None, 4)
+    >>> g.call(0x0150, 0xFFFC)
+    >>> g.step(0x00, 0xFFFC, 0xFFFC, None, 10)
+    >>> g.call(0x0200, 0xFFFA)
+    >>> g.step(0xC9, 0xFFFA, 0xFFFC, None, 16)
+    >>> g.step(0x00, 0xFFFC, 0xFFFC, None, 2)
+    >>> g.halted(100)
+    >>> g.collapsed()
+    ['(root) 4', '(root);main 12', '(root);main;(halted) 100', '(root);main;draw 16']
+    >>> g.functions()
+    [('(root)', 132, 4, 0), ('main', 128, 12, 1), ('(halted)', 100, 100, 0), ('draw', 16, 16, 1)]
+    """
+    def __init__(self, symbols=None, bank_of=bank_of):
+        self.symbols = symbols or {}
+        self.bank_of = bank_of
+        self.stacks = {}
+        self.calls = {}
+        self._path = ()
+        self._frames = []
+
+    def name(self, func):
+        if func == HALTED:
+            return "(halted)"
+        if func in self.symbols:
+            return self.symbols[func]
+        return "%02X:%04X" % (func >> 16, func & 0xFFFF)
+
+    def call(self, addr, sp):
+        """
+        PC has just been set to `addr` with the return address at `sp`
+        """
+        func = self.bank_of(addr) << 16 | addr
+        self._frames.append((sp, self._path))
+        self._path = self._path + (func,)
+        self.calls[func] = self.calls.get(func, 0) + 1
+
+    def step(self, ins, sp_before, sp_after, pc_after, cycles):
+        """
+        Count one instruction against the current stack, then follow
+        it into a call or out of a return
+        """
+        self.stacks[self._path] = self.stacks.get(self._path, 0) + cycles
+        if ins in CALLS and sp_after == sp_before - 2:
+            self.call(pc_after, sp_after)
+        elif ins in RETS and sp_after == sp_before + 2:
+            frames = self._frames
+            while frames and frames[-1][0] < sp_after:
+                self._path = frames.pop()[1]
+
+    def halted(self, cycles):
+        """
+        Count time spent in HALT / STOP, as a call from the current stack
+        """
+        path = self._path + (HALTED,)
+        self.stacks[path] = self.stacks.get(path, 0) + cycles
+
+    def collapsed(self):
+        """
+        One "outer;inner;innermost cycles" line per stack, the format
+        which flamegraph.pl and friends take
+        """
+        return [
+            ";".join(["(root)"] + [self.name(f) for f in path]) + " %d" % cycles
+            for path, cycles in sorted(self.stacks.items())
+        ]
+
+    def functions(self):
+        """
+        [(name, inclusive cycles, exclusive cycles, calls), ...] for
+        every function seen, by inclusive cycles; a function which is
+        on the stack more than once only counts once
+        """
+        inclusive = {None: 0}
+        exclusive = {None: 0}
+        for path, cycles in self.stacks.items():
+            inclusive[None] += cycles
+            for func in set(path):
+                inclusive[func] = inclusive.get(func, 0) + cycles
+            top = path[-1] if path else None
+            exclusive[top] = exclusive.get(top, 0) + cycles
+        return sorted(
+            (
+                ("(root)" if func is None else self.name(func),
+                 inclusive[func], exclusive.get(func, 0), self.calls.get(func, 0))
+                for func in inclusive
+            ),
+            key=lambda row: -row[1]
+        )
+
+    def report(self, n=20):
+        """
+        The top-n functions by inclusive cycles
+        """
+        funcs = self.functions()
+        total = funcs[0][1] if funcs else 0
+        lines = ["Functions by inclusive cycles:", "  name                        inclusive      %    exclusive      %      calls"]
+        for name, inc, exc, calls in funcs[:n]:
+            lines.append("  %-24s %12d %5.1f%% %12d %5.1f%% %10d" % (
+                name, inc, inc * 100 / (total or 1), exc, exc * 100 / (total or 1), calls))
+        return "\n".join(lines)
@@ -1,4 +1,5 @@
 from typing import Tuple
+import mmap
 import struct
 from pprint import pformat
 from enum import Enum
@@ -37,6 +38,19 @@ class CartType(Enum):
     HUDSON_HUC1 = 0xFF
 
 
+# The Nintendo logo, which every cart has at 0x0104 for the boot ROM to
+# check and scroll onto the screen
+LOGO = bytes([
+    0xCE, 0xED, 0x66, 0x66, 0xCC, 0x0D, 0x00, 0x0B, 0x03, 0x73, 0x00, 0x83,
+    0x00, 0x0C, 0x00, 0x0D, 0x00, 0x08, 0x11, 0x1F, 0x88, 0x89, 0x00, 0x0E,
+    0xDC, 0xCC, 0x6E, 0xE6, 0xDD, 0xDD, 0xD9, 0x99, 0xBB, 0xBB, 0x67, 0x63,
+    0x6E, 0x0E, 0xEC, 0xCC, 0xDD, 0xDC, 0x99, 0x9F, 0xBB, 0xB9, 0x33, 0x3E,
+])
+
+# Bytes of cart RAM for each value of the header's RAM size byte
+RAM_SIZES = {0x00: 0, 0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}
+
+
 class Destination(Enum):
     JP = 0
     OTHER = 1
@@ -51,8 +65,9 @@ class OldLicensee(Enum):
 
 
 class Cart:
-    def __init__(self, data: bytes):
+    def __init__(self, data: bytes, path: str = None):
         self.data = data
+        self.path = path
 
         self.rsts: str
         self.init: Tuple[int]
@@ -110,15 +125,65 @@ class Cart:
         if header_checksum != 0:
             raise CorruptCart("Header checksum failed: %02X != 0" % header_checksum)
 
+    @classmethod
+    def open(cls, path: str) -> "Cart":
+        """
+        Load a ROM file by mapping it into memory read-only rather than
+        reading it, so that loading takes the same time however big the
+        ROM is, and every process running the same ROM shares one copy
+        of it in the page cache
+
+        >>> cart = Cart.open("test_hello.gb")
+        >>> cart.name, type(cart.data).__name__
+        ('TEST', 'mmap')
+        """
+        with open(path, "rb") as fp:
+            try:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # empty files and things which aren't files can't be mapped
+                data = fp.read()
+        return cls(data, path)
+
+    @property
+    def ram_bytes(self) -> int:
+        return RAM_SIZES.get(self.ram_size, 0)
+
+    @property
+    def has_battery(self) -> bool:
+        return self.cart_type.name.endswith("_BATT")
+
     def __str__(self):
         to_print = {k: v for k, v in self.__dict__.items()}
         del to_print["data"]
+        del to_print["path"]
         del to_print["logo"]
         del to_print["rsts"]
         return pformat(to_print)
 
 
+def rom_image(size=0x8000, name=b"TEST", cart_type=CartType.ROM_ONLY) -> bytearray:
+    """
+    A blank ROM with a valid header, for tests to put code into; the
+    header checksum only covers 0x0134-0x014C, so the rest can be
+    changed freely
+
+    >>> rom = rom_image()
+    >>> rom[0x0150:0x0152] = [0x18, 0xFE]  # JR -2
+    >>> cart = Cart(rom)
+    >>> cart.name, cart.cart_type
+    ('TEST', <CartType.ROM_ONLY: 0>)
+    """
+    data = bytearray(size)
+    data[0x0104:0x0134] = LOGO
+    data[0x0134:0x0134 + len(name)] = name
+    data[0x0147] = cart_type.value
+    data[0x014D] = -(sum(data[0x0134:0x014D]) + 25) & 0xFF
+    return data
+
+
 class TestCart(Cart):
     def __init__(self):
+        # writable, so that tests can patch the ROM
         with open("test_hello.gb", "rb") as fp:
-            Cart.__init__(self, fp.read())
+            Cart.__init__(self, bytearray(fp.read()))
@@ -1,5 +1,13 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from cart import Cart, TestCart
+from events import Scheduler
+from profiler import Profile
+from callgraph import CallGraph
+from mmu import MMU
+from timer import Timer
+from joypad import Joypad
+from ppu import PPU, CYCLES_PER_FRAME
+import mbc
 from textwrap import dedent
 
 
@@ -54,34 +62,233 @@ except IOError:
 assert len(BOOT) == 0x100, f"Bootloader must be 256 bytes ({len(BOOT)})"
 
 
-class Reg(Enum):
-    A = "A"
-    B = "B"
-    C = "C"
-    D = "D"
-    E = "E"
-    F = "F"
-    H = "H"
-    L = "L"
-
-    BC = "BC"
-    DE = "DE"
-    AF = "AF"
-    HL = "HL"
-
-    SP = "SP"
-    PC = "PC"
-
-    MEM_AT_HL = "MEM_AT_HL"
+GEN_REGS = ["B", "C", "D", "E", "H", "L", "[HL]", "A"]
 
+# How the generated handlers get at each operand (REG_VAL to read it,
+# REG_SET to write it). [HL] needs its address working out first, which
+# REG_ADDR does, so that read-modify-write ops only do it once.
+REG_VAL = {reg: f"self.{reg}" for reg in GEN_REGS}
+REG_VAL["[HL]"] = "self._rd[h][l]"
+REG_SET = dict(REG_VAL)
+REG_SET["[HL]"] = "self._wr[h][l]"
+REG_ADDR = {reg: "" for reg in GEN_REGS}
+REG_ADDR["[HL]"] = "h, l = self.H, self.L"
+
+# Same for the 16-bit register pairs, which are written from a local `v`
+PAIR_VAL = {"BC": "(self.B << 8 | self.C)", "DE": "(self.D << 8 | self.E)", "HL": "(self.H << 8 | self.L)", "SP": "self.SP"}
+PAIR_SET = {"BC": "self.B, self.C = v >> 8, v & 0xFF", "DE": "self.D, self.E = v >> 8, v & 0xFF", "HL": "self.H, self.L = v >> 8, v & 0xFF", "SP": "self.SP = v"}
+
+# Bits of the F register
+F_Z = 0x80  # zero
+F_N = 0x40  # subtract
+F_H = 0x20  # half-carry
+F_C = 0x10  # carry
+
+
+def _alu_tables():
+    """
+    Results and flags for every (carry, A, n) input of ADD / ADC and
+    SUB / SBC / CP, indexed by `carry << 16 | A << 8 | n`.
+
+    For a given carry and A, the results for n = 0-255 are 0-255 rotated,
+    H repeats every 16 values of n and C is set from some n onwards, so
+    the tables get built a row of 256 at a time rather than entry by entry.
+    """
+    up = bytes(range(0x100))
+    down = up[::-1]
+    set_c = bytes(f | F_C for f in range(0x100))
+    add_a, add_f, sub_a, sub_f = [], [], [], []
+    for c in (0, 1):
+        for a in range(0x100):
+            # a + n + c: zero at n == -(a + c), carries from n == 0x100 - a - c
+            s = (a + c) & 0xFF
+            add_a.append(up[s:] + up[:s])
+            h = bytes(F_H if (a & 0x0F) + n + c > 0x0F else 0 for n in range(0x10)) * 0x10
+            carry = 0x100 - a - c
+            f = bytearray(h[:carry] + h[carry:].translate(set_c))
+            f[-s & 0xFF] |= F_Z
+            add_f.append(f)
+
+            # a - n - c: zero at n == a - c, borrows from n == a - c + 1
+            s = (0xFF - a + c) & 0xFF
+            sub_a.append(down[s:] + down[:s])
+            h = bytes(F_N | (F_H if a & 0x0F < n + c else 0) for n in range(0x10)) * 0x10
+            borrow = max(a - c + 1, 0)
+            f = bytearray(h[:borrow] + h[borrow:].translate(set_c))
+            f[(a - c) & 0xFF] |= F_Z
+            sub_f.append(f)
+    return b"".join(add_a), b"".join(add_f), b"".join(sub_a), b"".join(sub_f)
+
+
+def _daa_tables():
+    """
+    Result and flags of DAA, indexed by `(F & (N|H|C)) << 4 | A`
+    """
+    daa_a = bytearray(0x800)
+    daa_f = bytearray(0x800)
+    for i in range(0x800):
+        f, tmp = (i >> 4) & 0x70, i & 0xFF
+        if not f & F_N:
+            if f & F_H or (tmp & 0x0F) > 9:
+                tmp += 6
+            if f & F_C or tmp > 0x9F:
+                tmp += 0x60
+        else:
+            if f & F_H:
+                tmp -= 6
+                if not f & F_C:
+                    tmp &= 0xFF
+            if f & F_C:
+                tmp -= 0x60
 
-GEN_REGS = ["B", "C", "D", "E", "H", "L", "[HL]", "A"]
+        f &= F_N | F_C
+        if tmp & 0x100:
+            f |= F_C
+        if tmp & 0xFF == 0:
+            f |= F_Z
+        daa_a[i] = tmp & 0xFF
+        daa_f[i] = f
+    return bytes(daa_a), bytes(daa_f)
+
+
+ADD_A, ADD_F, SUB_A, SUB_F = _alu_tables()
+DAA_A, DAA_F = _daa_tables()
+# Z flag for a given result, and flags (bar C) for INC / DEC of a given input
+Z_F = bytes(F_Z if n == 0 else 0 for n in range(0x100))
+INC_F = bytes(Z_F[(n + 1) & 0xFF] | (F_H if n & 0x0F == 0x0F else 0) for n in range(0x100))
+DEC_F = bytes(Z_F[(n - 1) & 0xFF] | F_N | (F_H if n & 0x0F == 0x00 else 0) for n in range(0x100))
+
+
+def flag(mask):
+    """
+    A bool view of one bit of the F register
+    """
+    def get(self):
+        return bool(self.F & mask)
+
+    def set(self, val):
+        if val:
+            self.F |= mask
+        else:
+            self.F &= ~mask & 0xFF
+    return property(get, set)
 
 
 class OpNotImplemented(Exception):
     pass
 
 
+class Exit(Enum):
+    """
+    Why CPU.run() / CPU.run_until() returned
+    """
+    CYCLES = "cycles"
+    ADDRESS = "address"
+    PREDICATE = "predicate"
+    HALT = "halt"
+    STOP = "stop"
+
+
+class Interrupt(IntEnum):
+    """
+    Bits of IE (0xFFFF) and IF (0xFF0F), in priority order; each one
+    jumps to 0x40 + 8 * bit number when serviced
+    """
+    VBLANK = 0x01
+    STAT = 0x02
+    TIMER = 0x04
+    SERIAL = 0x08
+    JOYPAD = 0x10
+
+
+# Operand kinds, as stored in the CPU's decode table
+ARG_NONE = 0
+ARG_U8 = 1   # "B"
+ARG_S8 = 2   # "b"
+ARG_U16 = 3  # "H"
+ARG_KINDS = {"": ARG_NONE, "B": ARG_U8, "b": ARG_S8, "H": ARG_U16}
+ARG_LENGTHS = {ARG_NONE: 1, ARG_U8: 2, ARG_S8: 2, ARG_U16: 3}
+# The value of an ARG_S8 operand, indexed by its byte
+S8 = tuple(n - 0x100 if n >= 0x80 else n for n in range(0x100))
+
+# Opcodes which can change PC or CPU state, and so end a translated block
+BLOCK_ENDS = {
+    0x10, 0x18, 0x20, 0x28, 0x30, 0x38, 0x76,
+    0xC0, 0xC2, 0xC3, 0xC4, 0xC7, 0xC8, 0xC9, 0xCA, 0xCC, 0xCD, 0xCF,
+    0xD0, 0xD2, 0xD3, 0xD4, 0xD7, 0xD8, 0xD9, 0xDA, 0xDB, 0xDC, 0xDD, 0xDF,
+    0xE3, 0xE4, 0xE7, 0xE9, 0xEB, 0xEC, 0xED, 0xEF,
+    0xF3, 0xF4, 0xF7, 0xFB, 0xFC, 0xFD, 0xFF,
+}
+MAX_BLOCK_LEN = 64
+
+
+def _idle_ops():
+    """
+    The instructions which can make up an idle loop (one which only
+    polls memory until something else changes it), as opcode ->
+    (registers read, registers written, where memory is read from).
+    The flags count as the registers z, n, h and c.
+    """
+    ops = {0x00: ((), (), None)}
+    # ADD ADC SUB SBC AND XOR OR CP
+    alu = [
+        (("A",) + (("c",) if name in ("ADC", "SBC") else ()),
+         ("z", "n", "h", "c") if name == "CP" else ("A", "z", "n", "h", "c"))
+        for name in ["ADD", "ADC", "SUB", "SBC", "AND", "XOR", "OR", "CP"]
+    ]
+    for base, (reads, writes) in enumerate(alu):
+        ops[0xC6 + base * 8] = (reads, writes, None)
+    for s, src in enumerate(GEN_REGS):
+        reads, mem = ((src,), None) if src != "[HL]" else (("H", "L"), "HL")
+        for d, dst in enumerate(GEN_REGS):
+            if dst != "[HL]" and 0x40 + d * 8 + s != 0x76:
+                ops[0x40 + d * 8 + s] = (reads, (dst,), mem)
+        for base, (alu_reads, writes) in enumerate(alu):
+            ops[0x80 + base * 8 + s] = (alu_reads + reads, writes, mem)
+        for b in range(8):
+            ops[0x140 + b * 8 + s] = (reads, ("z", "n", "h"), mem)
+        if src != "[HL]":
+            ops[0x06 + s * 8] = ((), (src,), None)
+            ops[0x04 + s * 8] = ((src,), (src, "z", "n", "h"), None)
+            ops[0x05 + s * 8] = ((src,), (src, "z", "n", "h"), None)
+    ops[0x0A] = (("B", "C"), ("A",), "BC")
+    ops[0x1A] = (("D", "E"), ("A",), "DE")
+    ops[0xF2] = (("C",), ("A",), "C")
+    ops[0xF0] = ((), ("A",), "n")
+    ops[0xFA] = ((), ("A",), "nn")
+    ops[0x2F] = (("A",), ("A", "n", "h"), None)
+    return ops
+
+
+IDLE_OPS = _idle_ops()
+# The branches which can close an idle loop, and the flag they test
+IDLE_BRANCHES = {
+    0x18: (), 0x20: ("z",), 0x28: ("z",), 0x30: ("c",), 0x38: ("c",),
+    0xC3: (), 0xC2: ("z",), 0xCA: ("z",), 0xD2: ("c",), 0xDA: ("c",),
+}
+# Addresses which idle loops read through registers
+IDLE_ADDR = {
+    "HL": lambda cpu: cpu.H << 8 | cpu.L,
+    "BC": lambda cpu: cpu.B << 8 | cpu.C,
+    "DE": lambda cpu: cpu.D << 8 | cpu.E,
+    "C": lambda cpu: 0xFF00 | cpu.C,
+}
+# Registers which change as time passes, without any event to say so,
+# so polling them isn't idle
+VOLATILE = {0xFF04, 0xFF05}  # DIV, TIMA
+# Registers which change as time passes, but the PPU can say when, so
+# a loop polling them can skip ahead to that
+LCD_TIMED = {0xFF41, 0xFF44}  # STAT, LY
+
+SERIAL_CYCLES = 8 * 512  # 8 bits at 8192Hz
+DMA_CYCLES = 160 * 4  # one byte per machine cycle
+INTERRUPT_CYCLES = 20
+SAVE_CYCLES = 60 * CYCLES_PER_FRAME  # write battery RAM back once a second
+
+# Fields of each trace record
+TRACE_FIELDS = ("PC", "op", "arg", "A", "F", "B", "C", "D", "E", "H", "L", "SP")
+
+
 def opcode(name, cycles, args=""):
     def dec(fn):
         fn.name = name
@@ -92,15 +299,53 @@ def opcode(name, cycles, args=""):
 
 
 class CPU:
+    __slots__ = (
+        "cart", "interrupts", "halt", "stop", "_nopslide", "_debug",
+        "tick", "tick_block", "_trace", "_trace_pos", "_jit", "cycles", "_deadline",
+        "_clock", "sched", "timer", "ppu", "joypad", "stats", "_idle", "_idle_lcd", "_loops", "profile", "callgraph",
+        "A", "B", "C", "D", "E", "F", "H", "L", "SP", "PC",
+        "ram", "mmu", "mbc", "_rd", "_wr", "ops", "cb_ops", "_op_fn", "_op_cycles", "_op_args", "_op_len",
+        "_blocks", "_block_pages",
+    )
+
     # <editor-fold description="Init">
-    def __init__(self, cart: Cart=None, debug=False):
+    def __init__(self, cart: Cart=None, debug=False, jit=False, trace=0, profile=False, callgraph=False, save=None):
         self.cart = cart or TestCart()
         self.interrupts = True
         self.halt = False
         self.stop = False
         self._nopslide = 0
         self._debug = debug
-        self._debug_str = ""
+
+        # Ring buffer of the last `trace` instructions, as tuples of raw
+        # ints (see TRACE_FIELDS) which only get formatted on demand.
+        # Debug output is printed from the trace, so it needs a slot.
+        if debug:
+            trace = max(trace, 1)
+        self._trace = [None] * trace
+        self._trace_pos = 0
+
+        # Total cycles spent in run() / run_until() since power on, how
+        # far into the current call the instruction (or block) being run
+        # started, and the point at which run() should stop and look
+        # around; handlers set this to 0 when something needs the run
+        # loop's attention
+        self.cycles = 0
+        self._clock = 0
+        self._deadline = 0
+
+        # Hardware events, timestamped in absolute cycles
+        self.sched = Scheduler()
+
+        # Idle loops seen so far, keyed by `start << 16 | end`, the
+        # cycles per trip round the one PC has just looped back into,
+        # and which of the LCD_TIMED registers that one polls
+        self._loops = {}
+        self._idle = 0
+        self._idle_lcd = ()
+
+        # Counters for --stats
+        self.stats = {"idle_skips": 0, "idle_cycles": 0}
 
         # registers
         self.A = 0x01  # GB / SGB. FF=GBP, 11=GBC
@@ -114,21 +359,14 @@ class CPU:
         self.SP = 0xFFFE
         self.PC = 0x0000
 
-        # flags
-        self.FLAG_Z: bool = True  # zero
-        self.FLAG_N: bool = False  # subtract
-        self.FLAG_H: bool = True  # half-carry
-        self.FLAG_C: bool = True  # carry
+        # flags, packed as ZNHC0000
+        self.F = F_Z | F_H | F_C
 
-        self.ram = [0] * (0xFFFF+1)
+        self.ram = bytearray(0xFFFF+1)
 
         # 16KB ROM bank 0
-        for x in range(0x0000, 0x4000):
-            self.ram[x] = self.cart.data[x]
-
         # 16KB Switchable ROM bank
-        for x in range(0x4000, 0x8000):
-            self.ram[x] = self.cart.data[x]
+        # (mapped straight from the cart by the MBC, not copied here)
 
         # 8KB VRAM
         # 0x8000 - 0xA000
@@ -136,24 +374,24 @@ class CPU:
         # for x in range(0x8000, 0xA000):
         #   self.ram[x] = randint(0, 256)
 
-        # 8KB Switchable RAM bank
+        # 8KB Switchable RAM bank (also the MBC's)
         # 0xA000 - 0xC000
 
         # 8KB Internal RAM
         # 0xC000 - 0xE000
 
-        # Echo internal RAM
+        # Echo internal RAM (the MMU maps 0xC000 - 0xDE00 here again)
         # 0xE000 - 0xFE00
 
         # Sprite Attrib Memory (OAM)
         # 0xFE00 - 0xFEA0
 
-        # Empty
+        # Empty (reads as 0x00)
         # 0xFEA0 - 0xFF00
 
         # IO Ports
         # 0xFF00 - 0xFF4C
-        self.ram[0xFF00] = 0x00  # BUTTONS
+        self.ram[0xFF00] = 0x30  # P1 (BUTTONS)
 
         self.ram[0xFF01] = 0x00  # SB (Serial Data)
         self.ram[0xFF02] = 0x00  # SC (Serial Control)
@@ -188,7 +426,7 @@ class CPU:
         self.ram[0xFF41] = 0x00  # STAT
         self.ram[0xFF42] = 0x00  # SCX aka SCROLL_Y
         self.ram[0xFF43] = 0x00  # SCY aka SCROLL_X
-        self.ram[0xFF44] = 144  # LY aka currently drawn line, 0-153, >144 = vblank
+        self.ram[0xFF44] = 0x00  # LY aka currently drawn line, 0-153, >=144 = vblank
         self.ram[0xFF45] = 0x00  # LYC
         self.ram[0xFF46] = 0x00  # DMA
         self.ram[0xFF47] = 0xFC  # BGP
@@ -206,7 +444,26 @@ class CPU:
         # Interrupt Enabled Register
         self.ram[0xFFFF] = 0x00  # IE
 
-        # TODO: ram[E000-FE00] mirrors ram[C000-DE00]
+        # Handlers go through the MMU's page tables, and the I/O
+        # registers with side effects get hooked up
+        self.mmu = MMU(self.ram)
+        self.mmu.boot = memoryview(bytes(BOOT))
+        self.mbc = mbc.for_cart(self.cart, self.mmu, clock=self.now)
+        if save and self.cart.has_battery:
+            self.mbc.open_save(save)
+            self.sched.at(SAVE_CYCLES, "save", self._save)
+        self._rd = self.mmu.rd
+        self._wr = self.mmu.wr
+        io = self.mmu.io
+        io.on_write[0x01] = self._serial_data
+        io.on_write[0x02] = self._serial_control
+        io.on_write[0x0F] = self._interrupt_write(0x0F)
+        io.on_write[0x46] = self._dma
+        io.on_write[0x50] = self._boot_off
+        self.timer = Timer(self, lambda: self.request(Interrupt.TIMER))
+        self.joypad = Joypad(self, lambda: self.request(Interrupt.JOYPAD))
+        self.ppu = PPU(self, lambda: self.request(Interrupt.VBLANK), lambda: self.request(Interrupt.STAT))
+        io.on_write[0xFF] = self._interrupt_write(0xFF)
 
         self.ops = [
             getattr(self, "op%02X" % n)
@@ -217,6 +474,42 @@ class CPU:
             for n in range(0x00, 0xFF+1)
         ]
 
+        # Decode tables, built once so that tick() only does integer
+        # indexing. Entries 0x000-0x0FF are the plain opcodes, entries
+        # 0x100-0x1FF are the 0xCB-prefixed ones (whose length includes
+        # the prefix byte).
+        self._op_fn = self.ops + self.cb_ops
+        self._op_cycles = [fn.cycles for fn in self._op_fn]
+        self._op_args = [ARG_KINDS[fn.args] for fn in self._op_fn]
+        self._op_len = [ARG_LENGTHS[kind] for kind in self._op_args]
+        for n in range(0x100, 0x200):
+            self._op_len[n] += 1
+
+        # Translated basic blocks, keyed by start address (with the bank
+        # in bits 16+ for ROM), and which ones cover each page of RAM
+        # (which the MMU watches for writes)
+        self._blocks = {}
+        self._block_pages = {}
+        self._jit = jit
+        self.mbc.on_ram_map = self._cart_ram_mapped
+
+        # Per-opcode and per-PC counts, and cycles per guest call stack,
+        # when profiling
+        self.profile = Profile(bank_of=self.mbc.bank_of, rom_banks=self.mbc.rom_banks) if profile else None
+        self.callgraph = CallGraph(bank_of=self.mbc.bank_of) if callgraph else None
+
+        # Pick the step functions once, so that the ones used when not
+        # tracing or profiling don't need to check whether they should be
+        if profile or callgraph:
+            self.tick = self._tick_profile
+            self.tick_block = self._tick_profile
+        elif trace:
+            self.tick = self._tick_trace
+            self.tick_block = self._tick_trace
+        else:
+            self.tick = self._tick
+            self.tick_block = self._tick_block if jit else self._tick
+
     def __str__(self):
         s = (
             "ZNHC PC   SP   STACK:\n"
@@ -229,9 +522,9 @@ class CPU:
             f"H  {self.H:02X} {self.H:08b} {self.H}\n"
             f"L  {self.L:02X} {self.L:08b} {self.L}\n"
             % (
-                self.FLAG_Z or 0, self.FLAG_N or 0, self.FLAG_H or 0, self.FLAG_C or 0,
+                self.F >> 7 & 1, self.F >> 6 & 1, self.F >> 5 & 1, self.F >> 4 & 1,
                 self.PC, self.SP,
-                self.ram[self.SP], self.ram[self.SP+1],
+                self.mmu.read(self.SP), self.mmu.read((self.SP+1) & 0xFFFF),
             )
         )
         if (
@@ -249,21 +542,18 @@ class CPU:
     # </editor-fold>
 
     # <editor-fold description="Tick">
-    def tick(self):
+    def _tick(self):
         # TODO: extra cycles when conditional jumps are taken
 
-        if self.ram[0xFF50] == 0:
-            src = BOOT
-        else:
-            src = self.ram
-
-        if self.PC >= 0xFF00:
-            raise Exception("PC reached IO ports (0x%04X) after %d NOPs" % (self.PC, self._nopslide))
+        pc = self.PC
+        if 0xFF00 <= pc < 0xFF80:
+            raise Exception("PC reached IO ports (0x%04X) after %d NOPs" % (pc, self._nopslide))
 
-        ins = src[self.PC]
+        src = self.mmu.read
+        ins = src(pc)
         if ins == 0x00:
             self._nopslide += 1
-            self.PC += 1
+            self.PC = pc + 1
             if self._nopslide > 0xFF and False:
                 raise Exception("NOP slide")
             return 4
@@ -271,41 +561,664 @@ class CPU:
             self._nopslide = 0
 
         if ins == 0xCB:
-            ins = src[self.PC + 1]
-            cmd = self.cb_ops[ins]
-            self.PC += 1
-        else:
-            cmd = self.ops[ins]
-
-        if cmd.args == "B":
-            param = src[self.PC + 1]
-            self._debug_str = f"[{self.PC:04X}({ins:02X})]: {cmd.name.replace('n', '$%02X' % param)}"
-            self.PC += 2
-        elif cmd.args == "b":
-            param = src[self.PC + 1]
-            if param > 128:
-                param -= 256
-            self._debug_str = f"[{self.PC:04X}({ins:02X})]: {cmd.name.replace('n', '%d' % param)}"
-            self.PC += 2
-        elif cmd.args == "H":
-            param = (src[self.PC + 1]) | (src[self.PC + 2] << 8)
-            self._debug_str = f"[{self.PC:04X}({ins:02X})]: {cmd.name.replace('nn', '$%04X' % param)}"
-            self.PC += 3
+            ins = 0x100 | src(pc + 1)
+            pc += 1
+
+        kind = self._op_args[ins]
+        self.PC += self._op_len[ins]
+
+        if kind == ARG_NONE:
+            self._op_fn[ins]()
+        elif kind == ARG_U8:
+            self._op_fn[ins](src(pc + 1))
+        elif kind == ARG_S8:
+            self._op_fn[ins](S8[src(pc + 1)])
         else:
-            param = None
-            self._debug_str = f"[{self.PC:04X}({ins:02X})]: {cmd.name}"
-            self.PC += 1
+            self._op_fn[ins](src(pc + 1) | (src(pc + 2) << 8))
 
-        if self._debug:
-            print(self._debug_str)
-        if param is not None:
-            cmd(param)
+        return self._op_cycles[ins]
+
+    def _tick_trace(self):
+        """
+        Record the instruction at PC and the registers as they were
+        before running it, then run it as normal
+        """
+        pc = self.PC
+        if 0x0000 <= pc < 0xFF00 or 0xFF80 <= pc < 0xFFFE:
+            src = self.mmu.read
+            ins = src(pc)
+            if ins == 0xCB:
+                ins = 0x100 | src(pc + 1)
+                pc += 1
+            kind = self._op_args[ins]
+            if kind == ARG_U16:
+                arg = src(pc + 1) | (src(pc + 2) << 8)
+            elif kind != ARG_NONE:
+                arg = src(pc + 1)
+            else:
+                arg = -1
         else:
-            cmd()
+            ins = arg = -1
+
+        self._trace[self._trace_pos] = (
+            self.PC, ins, arg,
+            self.A, self.F, self.B, self.C, self.D, self.E, self.H, self.L, self.SP,
+        )
+        self._trace_pos = (self._trace_pos + 1) % len(self._trace)
+
         if self._debug:
+            print(self.format_trace(1)[0])
+            cycles = self._tick()
             print(self)
+            return cycles
+        return self._tick()
+
+    def _tick_profile(self):
+        """
+        Run one instruction as normal (or traced), and count it against
+        its opcode and address, and / or the guest's call stack
+
+        >>> c = CPU(profile=True)
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC003] = [0x3C, 0x18, 0xFD]  # INC A; JR -3
+        >>> c.PC = 0xC000
+        >>> c.run(100)
+        (100, <Exit.CYCLES: 'cycles'>)
+        >>> c.profile.top_ops()
+        [(24, 6, 72), (60, 7, 28)]
+
+        Idle loops run in full, and time spent halted gets counted too
+
+        >>> c = CPU(profile=True, callgraph=True)
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC006] = [0xF0, 0x80, 0xB7, 0x28, 0xFB, 0x76]  # LDH A,[$80]; OR A; JR Z,-5; HALT
+        >>> c.PC = 0xC000
+        >>> c.run(10000)
+        (10000, <Exit.CYCLES: 'cycles'>)
+        >>> sum(c.profile.op_cycles), c.stats["idle_skips"]
+        (10000, 0)
+        >>> c.ram[0xFF80] = 1
+        >>> c.run(10000)
+        (10000, <Exit.HALT: 'halt'>)
+        >>> c.profile.halted, c.callgraph.collapsed()
+        (9968, ['(root) 10032', '(root);(halted) 9968'])
+        """
+        pc = self.PC
+        if not (0x0000 <= pc < 0xFF00 or 0xFF80 <= pc < 0xFFFE):
+            return self._tick()
+        src = self.mmu.read
+        ins = src(pc)
+        if ins == 0xCB:
+            ins = 0x100 | src(pc + 1)
+        sp = self.SP
+        cycles = self._tick_trace() if self._trace else self._tick()
+        if self.profile:
+            self.profile.add(pc, ins, cycles)
+        if self.callgraph:
+            self.callgraph.step(ins, sp, self.SP, self.PC, cycles)
+        return cycles
+
+    def _tick_block(self):
+        """
+        Run the whole basic block starting at PC via its translated
+        function, translating it first if needed
+        """
+        pc = self.PC
+        key = pc if pc >= 0x8000 else self.mbc.banks[pc >> 14] | pc
+        if self.mmu.locked is not None:
+            # translated blocks don't go through the page tables
+            return self._tick()
+        block = self._blocks.get(key)
+        if block is None:
+            if not 0x0000 <= pc < 0xE000:
+                # echo RAM and up only get interpreted
+                return self._tick()
+            block = self._translate(pc, key)
+        return block()
+    # </editor-fold>
+
+    # <editor-fold description="Run">
+    def run(self, max_cycles):
+        """
+        Run for `max_cycles` cycles (or slightly more, as the instruction
+        or block which crosses the limit gets finished), returning how
+        many cycles passed and why it stopped. Events fire and interrupts
+        get serviced along the way; while the CPU is halted, time skips
+        straight to the next event.
+
+        Unlike tick(), this doesn't check for NOP slides or PC running
+        into the IO ports.
 
-        return cmd.cycles
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC003] = [0x3C, 0x18, 0xFD]  # INC A; JR -3
+        >>> c.PC, c.A = 0xC000, 0
+        >>> c.run(100)
+        (100, <Exit.CYCLES: 'cycles'>)
+        >>> c.A
+        7
+
+        >>> c.ram[0xC000] = 0x76  # HALT, until VBlank
+        >>> c.cart.data[0x0040:0x0042] = [0x3C, 0xD9]  # INC A; RETI
+        >>> c.ram[0xFFFF] = Interrupt.VBLANK
+        >>> c.PC, c.A = 0xC000, 0
+        >>> c.run(100000)
+        (100000, <Exit.HALT: 'halt'>)
+        >>> c.A, c.PC, c.ram[0xFF0F]
+        (1, 49153, 0)
+        """
+        sched = self.sched
+        base = self.cycles
+        clock = 0
+        self._idle = 0
+
+        while clock < max_cycles:
+            if self._idle:
+                clock = self._skip_idle(clock, min(max_cycles, sched.next - base))
+            self._clock = clock
+            clock += self._service(base + clock)
+            if self.halt or self.stop:
+                wake = min(max_cycles, sched.next - base)
+                self._halted(wake - clock)
+                clock = wake
+                continue
+            self._deadline = min(max_cycles, sched.next - base)
+
+            if self._trace or self.profile or self.callgraph:
+                # Tracing and profiling go one instruction at a time
+                tick = self.tick
+                while clock < self._deadline:
+                    self._clock = clock
+                    clock += tick()
+            elif self._jit and self.mmu.locked is None:
+                # (translated blocks don't go through the page tables,
+                # so while DMA has the bus everything gets interpreted)
+                blocks = self._blocks
+                banks = self.mbc.banks
+                translate = self._translate
+                while clock < self._deadline:
+                    self._clock = clock
+                    pc = self.PC
+                    key = pc if pc >= 0x8000 else banks[pc >> 14] | pc
+                    block = blocks.get(key)
+                    if block is None:
+                        if not 0x0000 <= pc < 0xE000:
+                            clock += self._tick()
+                            continue
+                        block = translate(pc, key)
+                    clock += block()
+            else:
+                rd = self._rd
+                fns = self._op_fn
+                args = self._op_args
+                lens = self._op_len
+                cycles = self._op_cycles
+                while clock < self._deadline:
+                    self._clock = clock
+                    pc = self.PC
+                    off = pc & 0xFF
+                    if off > 0xFD:
+                        # the instruction might run into the next page
+                        clock += self._tick()
+                        continue
+                    page = rd[pc >> 8]
+                    ins = page[off]
+                    if ins == 0xCB:
+                        ins = 0x100 | page[off + 1]
+                    self.PC = pc + lens[ins]
+                    kind = args[ins]
+                    if kind == ARG_NONE:
+                        fns[ins]()
+                    elif kind == ARG_U8:
+                        fns[ins](page[off + 1])
+                    elif kind == ARG_S8:
+                        fns[ins](S8[page[off + 1]])
+                    else:
+                        fns[ins](page[off + 1] | (page[off + 2] << 8))
+                    clock += cycles[ins]
+        return self._run_done(clock, max_cycles)
+
+    def run_until(self, until, max_cycles=None):
+        """
+        Run until PC reaches the address `until`, or the callable
+        `until(cpu)` returns True (both checked before each instruction),
+        or `max_cycles` have passed, returning how many cycles passed
+        and why it stopped. If the CPU halts with no interrupts enabled
+        (so it can never wake up), this returns straight away when
+        there's no limit, else idles out the rest of the time.
+
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC003] = [0x3C, 0x18, 0xFD]  # INC A; JR -3
+        >>> c.PC, c.A = 0xC000, 0
+        >>> c.run_until(0xC001)
+        (4, <Exit.ADDRESS: 'address'>)
+        >>> c.run_until(lambda cpu: cpu.A == 3)
+        (32, <Exit.PREDICATE: 'predicate'>)
+        >>> c.run_until(0x1234, max_cycles=100)
+        (108, <Exit.CYCLES: 'cycles'>)
+        """
+        tick = self.tick
+        sched = self.sched
+        ram = self.ram
+        base = self.cycles
+        clock = 0
+        limit = float("inf") if max_cycles is None else max_cycles
+        if callable(until):
+            reason = Exit.PREDICATE
+            done = until
+        else:
+            reason = Exit.ADDRESS
+            def done(cpu):
+                return cpu.PC == until
+
+        while clock < limit:
+            self._clock = clock
+            clock += self._service(base + clock)
+            if done(self):
+                self.cycles += clock
+                self._clock = 0
+                return clock, reason
+            if self.halt or self.stop:
+                wake = sched.next - base
+                if wake >= limit or not ram[0xFFFF] & 0x1F:
+                    break
+                self._halted(wake - clock)
+                clock = wake
+                continue
+            self._clock = clock
+            clock += tick()
+        return self._run_done(clock, max_cycles or clock)
+
+    def _run_done(self, clock, max_cycles):
+        if self.halt or self.stop:
+            self._halted(max_cycles - clock)
+            clock = max(clock, max_cycles)
+            reason = Exit.HALT if self.halt else Exit.STOP
+        else:
+            reason = Exit.CYCLES
+        self.cycles += clock
+        self._clock = 0
+        return clock, reason
+
+    def _halted(self, cycles):
+        # time spent in HALT / STOP, which the profilers count separately
+        # as no instructions run
+        if cycles > 0:
+            if self.profile:
+                self.profile.halted += cycles
+            if self.callgraph:
+                self.callgraph.halted(cycles)
+    # </editor-fold>
+
+    # <editor-fold description="Interrupts">
+    def _service(self, now):
+        """
+        Fire any events which are due by `now`, wake up from HALT / STOP
+        if there's an interrupt pending, and jump to the handler if
+        interrupts are enabled, returning the cycles that took
+        """
+        if self.sched.next <= now:
+            self.sched.run_due(now)
+        ram = self.ram
+        pending = ram[0xFFFF] & ram[0xFF0F] & 0x1F
+        if not pending:
+            return 0
+
+        self.halt = False
+        if pending & Interrupt.JOYPAD:
+            self.stop = False
+        if not self.interrupts:
+            return 0
+
+        bit = pending & -pending
+        ram[0xFF0F] &= ~bit
+        self.interrupts = False
+        sp = self.SP - 1
+        self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+        sp -= 1
+        self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+        self.SP = sp
+        self.PC = 0x40 + 8 * (bit.bit_length() - 1)
+        if self.callgraph:
+            self.callgraph.call(self.PC, sp)
+        return INTERRUPT_CYCLES
+
+    def now(self):
+        """
+        The time in cycles since power on, as of the start of the
+        current instruction (or block, with the JIT)
+        """
+        return self.cycles + self._clock
+
+    def request(self, interrupt: Interrupt):
+        """
+        Raise an interrupt by setting its bit in IF
+
+        >>> c = CPU()
+        >>> c.request(Interrupt.TIMER)
+        >>> c.request(Interrupt.JOYPAD)
+        >>> hex(c.ram[0xFF0F])
+        '0x14'
+        """
+        self.ram[0xFF0F] |= interrupt
+        self._deadline = 0
+
+    def _interrupt_write(self, reg):
+        # a write to IE or IF might make an interrupt pending
+        def write(val):
+            self.ram[0xFF00 | reg] = val
+            self._deadline = 0
+        return write
+
+    def _serial_data(self, val):
+        print(chr(val), end="")
+        self.ram[0xFF01] = val
+
+    def _serial_control(self, val):
+        self.ram[0xFF02] = val
+        if val & 0x81 == 0x81:
+            # start a transfer as soon as the run loop gets a look in
+            self.sched.at(0, "serial", self._serial_start)
+            self._deadline = 0
+
+    def _serial_start(self, when):
+        # There's no link cable partner, so the transfer always finishes
+        # (when driven by the internal clock) with 0xFF shifted in
+        now = self.sched.now
+        self.sched.at(now + SERIAL_CYCLES, "serial", self._serial_done)
+
+    def _serial_done(self, when):
+        self.ram[0xFF01] = 0xFF
+        self.ram[0xFF02] &= 0x7F
+        self.request(Interrupt.SERIAL)
+
+    def _dma(self, val):
+        """
+        Copy 160 bytes from `val << 8` into OAM, all in one go; the bus
+        is then busy until the 160 machine cycles the real transfer takes
+        are up, so the CPU can only use I/O and HRAM (everything else
+        reads 0xFF and ignores writes), which is why games run their DMA
+        wait loop from HRAM
+
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC0A0] = range(1, 161)
+        >>> c.ram[0xFF80:0xFF82] = [0x18, 0xFE]  # JR -2, in HRAM
+        >>> c.PC = 0xFF80
+        >>> c.mmu.write(0xFF46, 0xC0)
+        >>> c.mmu.read(0xFE00), c.ram[0xFE00], c.ram[0xFE9F]
+        (255, 1, 160)
+        >>> c.mmu.read(0xC000), c.mmu.read(0x0150), c.mmu.read(0xFF80)
+        (255, 255, 24)
+        >>> c.run(1000)
+        (1008, <Exit.CYCLES: 'cycles'>)
+        >>> c.mmu.read(0xFE00), c.mmu.read(0xC000)
+        (1, 1)
+        """
+        self.ram[0xFF46] = val
+        rd = self.mmu.locked[0] if self.mmu.locked else self._rd
+        page = rd[val - 0x20 if val >= 0xE0 else val]
+        if isinstance(page, memoryview):
+            self.ram[0xFE00:0xFEA0] = page[0x00:0xA0]
+        else:
+            self.ram[0xFE00:0xFEA0] = bytes(page[off] for off in range(0xA0))
+        self.mmu.lock()
+        # time the transfer from when the run loop gets a look in
+        self.sched.at(0, "dma", self._dma_start)
+        self._deadline = 0
+
+    def _dma_start(self, when):
+        now = self.sched.now
+        self.sched.at(now + DMA_CYCLES, "dma", self._dma_done)
+
+    def _dma_done(self, when):
+        self.mmu.unlock()
+
+    def _boot_off(self, val):
+        """
+        Writing to 0xFF50 unmaps the boot ROM, for good
+
+        >>> c = CPU()
+        >>> c.mmu.read(0x0000) == BOOT[0]
+        True
+        >>> c.mmu.write(0xFF50, 1)
+        >>> c.mmu.read(0x0000) == c.cart.data[0]
+        True
+        """
+        self.ram[0xFF50] = val
+        if val and self.mmu.boot is not None:
+            self.mmu.boot = None
+            self.mbc.remap()
+            for key in [key for key in self._blocks if key < 0x100]:
+                del self._blocks[key]
+
+    def _save(self, when):
+        self.mbc.flush()
+        self.sched.at(when + SAVE_CYCLES, "save", self._save)
+    # </editor-fold>
+
+    # <editor-fold description="Idle Loops">
+    def _loop(self, start, end):
+        """
+        Called when the branch which ends at `end` jumps back to `start`.
+        If that's an idle loop, which will keep going round until
+        something other than the CPU writes to memory, run() can skip
+        ahead to the next event. Not when profiling, as the skipped trips
+        round the loop would never get counted.
+
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC005] = [0xF0, 0x80, 0xB7, 0x28, 0xFB]  # LDH A,[$80]; OR A; JR Z,-5
+        >>> c.PC = 0xC000
+        >>> c.run(10000)
+        (10008, <Exit.CYCLES: 'cycles'>)
+        >>> c.stats
+        {'idle_skips': 1, 'idle_cycles': 9984}
+        """
+        if self.profile or self.callgraph:
+            return
+        key = start << 16 | end
+        if start < 0x8000:
+            key |= self.mbc.banks[start >> 14] << 16
+        loop = self._loops.get(key)
+        if loop is None:
+            loop = self._loops[key] = self._idle_loop(start, end)
+        if loop and loop[1] == self.mmu.read_range(start, end):
+            lcd = loop[3]
+            for mem in loop[2]:
+                addr = IDLE_ADDR[mem](self)
+                if addr in VOLATILE:
+                    return
+                if addr in LCD_TIMED:
+                    lcd += (addr,)
+            self._idle = loop[0]
+            self._idle_lcd = lcd
+            self._deadline = 0
+
+    def _idle_loop(self, start, end):
+        """
+        If the code in [start, end) is a loop which only reads memory
+        and registers that it doesn't change itself, so every trip round
+        it is the same as the last, return (cycles per trip, the code,
+        the kinds of address it reads through registers, the LCD_TIMED
+        registers it reads directly); else ()
+
+        >>> c = CPU()
+        >>> c.ram[0xC000:0xC006] = [0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA]  # LDH A,[LY]; CP $90; JR NZ,-6
+        >>> c._idle_loop(0xC000, 0xC006)[0], c._idle_loop(0xC000, 0xC006)[3]
+        (28, (65348,))
+        >>> c.ram[0xC000:0xC003] = [0x05, 0x20, 0xFD]  # DEC B; JR NZ,-3
+        >>> c._idle_loop(0xC000, 0xC003)
+        ()
+        >>> c.ram[0xC000:0xC004] = [0xF0, 0x04, 0x18, 0xFC]  # LDH A,[DIV]; JR -4
+        >>> c._idle_loop(0xC000, 0xC004)
+        ()
+        """
+        read = self.mmu.read
+        pc = start
+        cycles = 0
+        written = set()
+        live_in = set()
+        indirect = []
+        lcd = []
+        while pc < end:
+            ins = read(pc)
+            if ins == 0xCB:
+                ins = 0x100 | read(pc + 1)
+            size = self._op_len[ins]
+            cycles += self._op_cycles[ins]
+            if pc + size == end and ins in IDLE_BRANCHES:
+                if ins < 0x40:
+                    target = end + S8[read(pc + 1)]
+                else:
+                    target = read(pc + 1) | read(pc + 2) << 8
+                if target != start:
+                    return ()
+                reads, writes, mem = IDLE_BRANCHES[ins], (), None
+            elif ins in IDLE_OPS:
+                reads, writes, mem = IDLE_OPS[ins]
+            else:
+                return ()
+
+            live_in.update(reg for reg in reads if reg not in written)
+            written.update(writes)
+            if mem == "n" or mem == "nn":
+                addr = 0xFF00 | read(pc + 1) if mem == "n" else read(pc + 1) | read(pc + 2) << 8
+                if addr in VOLATILE:
+                    return ()
+                if addr in LCD_TIMED:
+                    lcd.append(addr)
+            if mem in IDLE_ADDR:
+                indirect.append(mem)
+            pc += size
+
+        if pc != end or live_in & written:
+            return ()
+        return cycles, self.mmu.read_range(start, end), tuple(indirect), tuple(lcd)
+
+    def _skip_idle(self, clock, wake):
+        """
+        Skip whole trips round the idle loop that PC is at the start of,
+        up to `wake` or until LY / STAT change if it's polling them,
+        returning the new clock
+
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC000:0xC006] = [0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA]  # LDH A,[LY]; CP $90; JR NZ,-6
+        >>> c.PC = 0xC000
+        >>> c.run(144 * 456)  # up to VBlank
+        (65688, <Exit.CYCLES: 'cycles'>)
+        >>> c.mmu.read(0xFF44), c.stats["idle_skips"]
+        (144, 144)
+        """
+        trip = self._idle
+        self._idle = 0
+        if self._idle_lcd:
+            change = self.ppu.next_change(self.cycles + clock, 0xFF41 in self._idle_lcd)
+            if change is not None:
+                wake = min(wake, change - self.cycles)
+        if wake <= clock:
+            return clock
+        skipped = -(-(wake - clock) // trip) * trip
+        self.stats["idle_skips"] += 1
+        self.stats["idle_cycles"] += skipped
+        return clock + skipped
+    # </editor-fold>
+
+    # <editor-fold description="Translation">
+    def _translate(self, start, key=None):
+        """
+        Turn the guest code from `start` up to the next jump / call /
+        ret (or other state-changing instruction) into one Python
+        function which calls each handler with its operand already
+        decoded, and returns the total cycles taken.
+
+        Self-modifying code is handled by throwing the block away when
+        any byte it covers is written; a block which overwrites its own
+        later instructions will still run the old ones this time. Blocks
+        in ROM are stored under `key`, which includes the bank, and stop
+        at the end of the 16KB bank they start in.
+        """
+        src = self.mmu.read
+        pc = start
+        fns = []
+        lines = []
+        cycles = 0
+        count = 0
+        while True:
+            ins = src(pc)
+            if ins == 0xCB:
+                ins = 0x100 | src(pc + 1)
+            kind = self._op_args[ins]
+            if kind == ARG_NONE:
+                param = ""
+            elif kind == ARG_U8:
+                param = "0x%02X" % src(pc + 1)
+            elif kind == ARG_S8:
+                param = "%d" % S8[src(pc + 1)]
+            else:
+                param = "0x%04X" % (src(pc + 1) | (src(pc + 2) << 8))
+            pc += self._op_len[ins]
+            cycles += self._op_cycles[ins]
+            count += 1
+
+            if ins in BLOCK_ENDS:
+                lines.append(f"cpu.PC = 0x{pc:04X}")
+                lines.append(f"h{len(fns)}({param})")
+                fns.append(self._op_fn[ins])
+                break
+            if ins != 0x00:
+                lines.append(f"h{len(fns)}({param})")
+                fns.append(self._op_fn[ins])
+            if count >= MAX_BLOCK_LEN or pc >= 0xE000 or (start < 0x8000 and pc >> 14 != start >> 14):
+                lines.append(f"cpu.PC = 0x{pc:04X}")
+                break
+
+        names = ", ".join(f"h{n}" for n in range(len(fns)))
+        body = "\n".join("        " + line for line in lines)
+        env = {}
+        exec(
+            f"def make(cpu, {names}):\n"
+            f"    def block():\n"
+            f"{body}\n"
+            f"        return {cycles}\n"
+            f"    return block\n",
+            env
+        )
+        block = env["make"](self, *fns)
+        block.end = pc
+
+        if start < 0x8000:
+            # ROM can't be written, so doesn't need watching
+            self._blocks[start if key is None else key] = block
+            return block
+        self._blocks[start] = block
+        for page in range(start >> 8, ((pc - 1) >> 8) + 1):
+            self._block_pages.setdefault(page, set()).add(start)
+            self.mmu.watch(page, self._invalidate)
+        return block
+
+    def _invalidate(self, addr):
+        page = addr >> 8
+        starts = self._block_pages.get(page, ())
+        for start in [s for s in starts if s <= addr < self._blocks[s].end]:
+            block = self._blocks.pop(start)
+            for p in range(start >> 8, ((block.end - 1) >> 8) + 1):
+                self._block_pages[p].discard(start)
+                if not self._block_pages[p]:
+                    self.mmu.unwatch(p, self._invalidate)
+
+    def _cart_ram_mapped(self):
+        # a different bank of cart RAM (or none) is at 0xA000, so the
+        # blocks translated from there are gone
+        for page in range(0xA0, 0xC0):
+            for start in self._block_pages.pop(page, ()):
+                block = self._blocks.pop(start, None)
+                if block:
+                    for p in range(start >> 8, ((block.end - 1) >> 8) + 1):
+                        if p in self._block_pages:
+                            self._block_pages[p].discard(start)
     # </editor-fold>
 
     # <editor-fold description="Debugger">
@@ -315,9 +1228,53 @@ class CPU:
             if cmd[0] == "cpu":
                 print(self)
             if cmd[0] == "ram":
-                print("%02X" % self.ram[int(cmd[1], 16)])
+                print("%02X" % self.mmu.read(int(cmd[1], 16)))
+            if cmd[0] == "trace":
+                print("\n".join(self.format_trace(int(cmd[1]) if len(cmd) > 1 else None)))
             if cmd[0] == "run":
                 break
+
+    def format_trace(self, count=None):
+        """
+        Turn the last `count` (default: all) trace records into
+        disassembly plus register dumps, oldest first
+
+        >>> c = CPU(trace=4)
+        >>> c.PC = 0x0150
+        >>> c.cart.data[0x0150:0x0153] = [0x21, 0x34, 0x12]  # LD HL,$1234
+        >>> c.mmu.write(0xFF50, 1)
+        >>> c.B = 0x42
+        >>> _ = c.tick()
+        >>> c.format_trace()
+        ['[0150(21)]: LD HL,$1234  A=01 F=B0 BC=4213 DE=00D8 HL=014D SP=FFFE']
+        """
+        size = len(self._trace)
+        records = [
+            self._trace[(self._trace_pos + n) % size]
+            for n in range(size)
+        ]
+        records = [r for r in records if r is not None]
+        if count is not None:
+            records = records[-count:]
+
+        lines = []
+        for pc, ins, arg, a, f, b, c, d, e, h, l, sp in records:
+            if ins == -1:
+                name = "???"
+            else:
+                name = self._op_fn[ins].name
+                kind = self._op_args[ins]
+                if kind == ARG_U8:
+                    name = name.replace('n', '$%02X' % arg)
+                elif kind == ARG_S8:
+                    name = name.replace('n', '%d' % S8[arg])
+                elif kind == ARG_U16:
+                    name = name.replace('nn', '$%04X' % arg)
+            lines.append(
+                f"[{pc:04X}({ins & 0xFF:02X})]: {name}  "
+                f"A={a:02X} F={f:02X} BC={b:02X}{c:02X} DE={d:02X}{e:02X} HL={h:02X}{l:02X} SP={sp:04X}"
+            )
+        return lines
     # </editor-fold>
 
     # <editor-fold description="Registers">
@@ -333,21 +1290,24 @@ class CPU:
         >>> cpu.AF
         496
         """
-        return (
-            self.A << 8 |
-            (self.FLAG_Z or 0) << 7 |
-            (self.FLAG_N or 0) << 6 |
-            (self.FLAG_H or 0) << 5 |
-            (self.FLAG_C or 0) << 4
-        )
+        return self.A << 8 | self.F
 
     @AF.setter
     def AF(self, val):
+        """
+        >>> cpu = CPU()
+        >>> cpu.AF = 0x12FF
+        >>> hex(cpu.F)
+        '0xf0'
+        """
         self.A = val >> 8 & 0xFF
-        self.FLAG_Z = bool(val & 0b10000000)
-        self.FLAG_N = bool(val & 0b01000000)
-        self.FLAG_H = bool(val & 0b00100000)
-        self.FLAG_C = bool(val & 0b00010000)
+        # the low nibble of F is always zero
+        self.F = val & 0xF0
+
+    FLAG_Z = flag(F_Z)
+    FLAG_N = flag(F_N)
+    FLAG_H = flag(F_H)
+    FLAG_C = flag(F_C)
 
     @property
     def BC(self):
@@ -408,11 +1368,11 @@ class CPU:
 
     @property
     def MEM_AT_HL(self):
-        return self.ram[self.HL]
+        return self.mmu.read(self.HL)
 
     @MEM_AT_HL.setter
     def MEM_AT_HL(self, val):
-        self.ram[self.HL] = val
+        self.mmu.write(self.HL, val)
     # </editor-fold>
 
     # <editor-fold description="Empty Instructions">
@@ -445,13 +1405,13 @@ class CPU:
     # ===================================
     # 1. LD nn,n
     for base, reg_to in enumerate(GEN_REGS):
-        cycles = 12 if "[HL]" in {reg_to} else 8
+        time = 12 if "[HL]" in {reg_to} else 8
         op = 0x06 + base * 8
-        reg_to_name = reg_to.replace('[HL]', 'MEM_AT_HL')
         exec(dedent(f"""
-            @opcode("LD {reg_to},n", {cycles}, "B")
+            @opcode("LD {reg_to},n", {time}, "B")
             def op{op:02X}(self, val):
-                self.{reg_to_name} = val
+                {REG_ADDR[reg_to]}
+                {REG_SET[reg_to]} = val
         """))
 
     # ===================================
@@ -462,46 +1422,55 @@ class CPU:
             if reg_from == "[HL]" and reg_to == "[HL]":
                 continue
 
-            cycles = 8 if "[HL]" in {reg_from, reg_to} else 4
+            time = 8 if "[HL]" in {reg_from, reg_to} else 4
             op = 0x40 + base * 8 + offset
-            reg_to_name = reg_to.replace('[HL]', 'MEM_AT_HL')
-            reg_from_name = reg_from.replace('[HL]', 'MEM_AT_HL')
             exec(dedent(f"""
-                @opcode("LD {reg_to},{reg_from}", {cycles})
+                @opcode("LD {reg_to},{reg_from}", {time})
                 def op{op:02X}(self):
-                    self.{reg_to_name} = self.{reg_from_name}
+                    {REG_ADDR[reg_to] or REG_ADDR[reg_from]}
+                    {REG_SET[reg_to]} = {REG_VAL[reg_from]}
             """))
 
     # ===================================
     # 3. LD A,n
     # Put n into A
-    def _ld_val_to_a(self, val):
-        self.A = val
+    @opcode("LD A,[BC]", 8)
+    def op0A(self):
+        self.A = self._rd[self.B][self.C]
 
-    op0A = opcode("LD A,[BC]", 8)(lambda self: self._ld_val_to_a(self.ram[self.BC]))
-    op1A = opcode("LD A,[DE]", 8)(lambda self: self._ld_val_to_a(self.ram[self.DE]))
-    opFA = opcode("LD A,[nn]", 16, "H")(lambda self, val: self._ld_val_to_a(self.ram[val]))
+    @opcode("LD A,[DE]", 8)
+    def op1A(self):
+        self.A = self._rd[self.D][self.E]
+
+    @opcode("LD A,[nn]", 16, "H")
+    def opFA(self, val):
+        self.A = self._rd[val >> 8][val & 0xFF]
 
     # ===================================
     # 4. LD [nn],A
-    def _ld_a_to_mem(self, val):
-        self.ram[val] = self.A
+    @opcode("LD [BC],A", 8)
+    def op02(self):
+        self._wr[self.B][self.C] = self.A
+
+    @opcode("LD [DE],A", 8)
+    def op12(self):
+        self._wr[self.D][self.E] = self.A
 
-    op02 = opcode("LD [BC],A", 8)(lambda self: self._ld_a_to_mem(self.BC))
-    op12 = opcode("LD [DE],A", 8)(lambda self: self._ld_a_to_mem(self.DE))
-    opEA = opcode("LD [nn],A", 16, 'H')(lambda self, val: self._ld_a_to_mem(val))
+    @opcode("LD [nn],A", 16, "H")
+    def opEA(self, val):
+        self._wr[val >> 8][val & 0xFF] = self.A
 
     # ===================================
     # 5. LD A,(C)
     @opcode("LD A,[C]", 8)
     def opF2(self):
-        self.A = self.ram[0xFF00 + self.C]
+        self.A = self._rd[0xFF][self.C]
 
     # ===================================
     # 6. LD (C),A
     @opcode("LD A,[C]", 8)
     def opE2(self):
-        self.ram[0xFF00 + self.C] = self.A
+        self._wr[0xFF][self.C] = self.A
 
     # ===================================
     # 7. LD A,[HLD]
@@ -509,8 +1478,10 @@ class CPU:
     # 9. LDD A,[HL]
     @opcode("LD A,[HL-]", 8)
     def op3A(self):
-        self.A = self.ram[self.HL]
-        self.HL -= 1
+        hl = self.H << 8 | self.L
+        self.A = self._rd[self.H][self.L]
+        hl = (hl - 1) & 0xFFFF
+        self.H, self.L = hl >> 8, hl & 0xFF
 
     # ===================================
     # 10. LD [HLD],A
@@ -518,8 +1489,10 @@ class CPU:
     # 12. LDD [HL],A
     @opcode("LD [HL-],A", 8)
     def op32(self):
-        self.ram[self.HL] = self.A
-        self.HL -= 1
+        hl = self.H << 8 | self.L
+        self._wr[self.H][self.L] = self.A
+        hl = (hl - 1) & 0xFFFF
+        self.H, self.L = hl >> 8, hl & 0xFF
 
     # ===================================
     # 13. LD A,[HLI]
@@ -527,8 +1500,10 @@ class CPU:
     # 15. LDI A,[HL]
     @opcode("LD A,[HL+]", 8)
     def op2A(self):
-        self.A = self.ram[self.HL]
-        self.HL += 1
+        hl = self.H << 8 | self.L
+        self.A = self._rd[self.H][self.L]
+        hl = (hl + 1) & 0xFFFF
+        self.H, self.L = hl >> 8, hl & 0xFF
 
     # ===================================
     # 16. LD [HLI],A
@@ -536,64 +1511,65 @@ class CPU:
     # 18. LDI [HL],A
     @opcode("LD [HL+],A", 8)
     def op22(self):
-        self.ram[self.HL] = self.A
-        self.HL += 1
+        hl = self.H << 8 | self.L
+        self._wr[self.H][self.L] = self.A
+        hl = (hl + 1) & 0xFFFF
+        self.H, self.L = hl >> 8, hl & 0xFF
 
     # ===================================
     # 19. LDH [n],A
     @opcode("LDH [n],A", 12, "B")
     def opE0(self, val):
-        if val == 0x01:
-            print(chr(self.A), end="")
-            # print("0xFF%02X = 0x%02X (%s)" % (val, self.A, chr(self.A)))
-        self.ram[0xFF00 + val] = self.A
+        self._wr[0xFF][val] = self.A
 
     # ===================================
     # 20. LDH A,[n]
     @opcode("LDH A,[n]", 12, "B")
     def opF0(self, val):
-        self.A = self.ram[0xFF00 + val]
+        self.A = self._rd[0xFF][val]
     # </editor-fold>
 
     # <editor-fold description="3.3.2 16-Bit Loads">
     # ===================================
     # 1. LD n,nn
-    def _ld_val_to_reg(self, val, reg: Reg):
-        setattr(self, reg.value, val)
-
-    op01 = opcode("LD BC,nn", 12, "H")(lambda self, val: self._ld_val_to_reg(val, Reg.BC))
-    op11 = opcode("LD DE,nn", 12, "H")(lambda self, val: self._ld_val_to_reg(val, Reg.DE))
-    op21 = opcode("LD HL,nn", 12, "H")(lambda self, val: self._ld_val_to_reg(val, Reg.HL))
-    op31 = opcode("LD SP,nn", 12, "H")(lambda self, val: self._ld_val_to_reg(val, Reg.SP))
+    for base, pair in enumerate(["BC", "DE", "HL", "SP"]):
+        op = 0x01 + base * 0x10
+        exec(dedent(f"""
+            @opcode("LD {pair},nn", 12, "H")
+            def op{op:02X}(self, v):
+                {PAIR_SET[pair]}
+        """))
 
     # ===================================
     # 2. LD SP,HL
 
     @opcode("LD SP,HL", 8)
     def opF9(self):
-        self.SP = self.HL
+        self.SP = self.H << 8 | self.L
 
     # ===================================
     # 3. LD HL,SP+n
     # 4. LDHL SP,n
     @opcode("LD HL,SP+n", 12, "b")
     def opF8(self, val):
-        self.FLAG_H = ((((self.SP & 0x0f) + (val & 0x0f)) & 0x10) != 0)
-        self.FLAG_C = ((((self.SP & 0xff) + (val & 0xff)) & 0x100) != 0)
-        self.HL = self.SP + val
-        self.FLAG_Z = False
-        self.FLAG_N = False
+        self.F = (
+            (F_H if ((self.SP & 0x0f) + (val & 0x0f)) & 0x10 else 0) |
+            (F_C if ((self.SP & 0xff) + (val & 0xff)) & 0x100 else 0)
+        )
+        hl = (self.SP + val) & 0xFFFF
+        self.H, self.L = hl >> 8, hl & 0xFF
 
     # ===================================
     # 5. LD [nn],SP
     @opcode("LD [nn],SP", 20, "H")
     def op08(self, val):
-        self.ram[val+1] = (self.SP >> 8) & 0xFF
-        self.ram[val] = self.SP & 0xFF
+        self._wr[val >> 8][val & 0xFF] = self.SP & 0xFF
+        val += 1
+        self._wr[val >> 8][val & 0xFF] = (self.SP >> 8) & 0xFF
 
     # ===================================
     # 6. PUSH nn
-    def _push16(self, reg: Reg):
+    def _test_push16(self):
         """
         >>> c = CPU()
         >>> c.BC = 1234
@@ -602,345 +1578,197 @@ class CPU:
         >>> c.DE
         1234
         """
-        val = getattr(self, reg.value)
-        self.ram[self.SP - 1] = (val & 0xFF00) >> 8
-        self.ram[self.SP - 2] = val & 0xFF
-        self.SP -= 2
-        # print("Pushing %r to stack at %r [%r]" % (val, self.SP, self.ram[-10:]))
-
-    opF5 = opcode("PUSH AF", 16)(lambda self: self._push16(Reg.AF))
-    opC5 = opcode("PUSH BC", 16)(lambda self: self._push16(Reg.BC))
-    opD5 = opcode("PUSH DE", 16)(lambda self: self._push16(Reg.DE))
-    opE5 = opcode("PUSH HL", 16)(lambda self: self._push16(Reg.HL))
+    for base, (hi, lo) in enumerate(["BC", "DE", "HL", "AF"]):
+        op = 0xC5 + base * 0x10
+        exec(dedent(f"""
+            @opcode("PUSH {hi}{lo}", 16)
+            def op{op:02X}(self):
+                sp = self.SP - 1
+                self._wr[sp >> 8][sp & 0xFF] = self.{hi}
+                sp -= 1
+                self._wr[sp >> 8][sp & 0xFF] = self.{lo}
+                self.SP = sp
+        """))
 
     # ===================================
     # 6. POP nn
-    def _pop16(self, reg: Reg):
-        val = (self.ram[self.SP+1] << 8) | self.ram[self.SP]
-        # print("Set %r to %r from %r, %r" % (reg, val, self.SP, self.ram[-10:]))
-        setattr(self, reg.value, val)
-        self.SP += 2
-
-    opF1 = opcode("POP AF", 12)(lambda self: self._pop16(Reg.AF))
-    opC1 = opcode("POP BC", 12)(lambda self: self._pop16(Reg.BC))
-    opD1 = opcode("POP DE", 12)(lambda self: self._pop16(Reg.DE))
-    opE1 = opcode("POP HL", 12)(lambda self: self._pop16(Reg.HL))
+    for base, (hi, lo) in enumerate(["BC", "DE", "HL", "AF"]):
+        op = 0xC1 + base * 0x10
+        # the low nibble of F is always zero
+        mask = " & 0xF0" if lo == "F" else ""
+        exec(dedent(f"""
+            @opcode("POP {hi}{lo}", 12)
+            def op{op:02X}(self):
+                sp = self.SP
+                self.{lo} = self._rd[sp >> 8][sp & 0xFF]{mask}
+                sp += 1
+                self.{hi} = self._rd[sp >> 8][sp & 0xFF]
+                self.SP = sp + 1
+        """))
 
     # </editor-fold>
 
     # <editor-fold description="3.3.3 8-Bit Arithmetic">
-
-    # ===================================
     # 1. ADD A,n
-    def _add(self, val):
-        self.FLAG_C = self.A + val > 0xFF
-        self.FLAG_H = (self.A & 0x0F) + (val & 0x0F) > 0x0F
-        self.FLAG_N = False
-        self.A += val
-        self.A &= 0xFF
-        self.FLAG_Z = self.A == 0
-
-    op80 = opcode("ADD A,B", 4)(lambda self: self._add(self.B))
-    op81 = opcode("ADD A,C", 4)(lambda self: self._add(self.C))
-    op82 = opcode("ADD A,D", 4)(lambda self: self._add(self.D))
-    op83 = opcode("ADD A,E", 4)(lambda self: self._add(self.E))
-    op84 = opcode("ADD A,H", 4)(lambda self: self._add(self.H))
-    op85 = opcode("ADD A,L", 4)(lambda self: self._add(self.L))
-    op86 = opcode("ADD A,[HL]", 8)(lambda self: self._add(self.MEM_AT_HL))
-    op87 = opcode("ADD A,A", 4)(lambda self: self._add(self.A))
-
-    opC6 = opcode("ADD A,n", 8, "B")(lambda self, val: self._add(val))
-
-    # ===================================
     # 2. ADC A,n
-    def _adc(self, val):
+    # 3. SUB n
+    # 4. SBC n
+    # 5. AND n
+    # 6. OR n
+    # 7. XOR
+    # 8. CP
+    # Each op is specialised for every operand, with `v` standing in for
+    # the operand in these templates
+    def _test_alu(self):
         """
         >>> c = CPU()
         >>> c.FLAG_C = True
         >>> c.A = 10
         >>> c.B = 5
-        >>> c.op88()
+        >>> c.op88()  # ADC A,B
         >>> c.A
         16
-        """
-        carry = int(self.FLAG_C)
-        self.FLAG_C = bool(self.A + val + int(self.FLAG_C) > 0xFF)
-        self.FLAG_H = (self.A & 0x0F) + (val & 0x0F) + carry > 0x0F
-        self.FLAG_N = False
-        self.A += val + carry
-        self.A &= 0xFF
-        self.FLAG_Z = self.A == 0
-
-    op88 = opcode("ADC A,B", 4)(lambda self: self._adc(self.B))
-    op89 = opcode("ADC A,C", 4)(lambda self: self._adc(self.C))
-    op8A = opcode("ADC A,D", 4)(lambda self: self._adc(self.D))
-    op8B = opcode("ADC A,E", 4)(lambda self: self._adc(self.E))
-    op8C = opcode("ADC A,H", 4)(lambda self: self._adc(self.H))
-    op8D = opcode("ADC A,L", 4)(lambda self: self._adc(self.L))
-    op8E = opcode("ADC A,[HL]", 8)(lambda self: self._adc(self.MEM_AT_HL))
-    op8F = opcode("ADC A,A", 4)(lambda self: self._adc(self.A))
-
-    opCE = opcode("ADC A,n", 8, "B")(lambda self, val: self._adc(val))
 
-    # ===================================
-    # 3. SUB n
-    def _sub(self, val):
-        self.FLAG_C = self.A < val
-        self.FLAG_H = (self.A & 0x0F) < (val & 0x0F)
-        self.A -= val
-        self.A &= 0xFF
-        self.FLAG_Z = self.A == 0
-        self.FLAG_N = True
-
-    op90 = opcode("SUB A,B", 4)(lambda self: self._sub(self.B))
-    op91 = opcode("SUB A,C", 4)(lambda self: self._sub(self.C))
-    op92 = opcode("SUB A,D", 4)(lambda self: self._sub(self.D))
-    op93 = opcode("SUB A,E", 4)(lambda self: self._sub(self.E))
-    op94 = opcode("SUB A,H", 4)(lambda self: self._sub(self.H))
-    op95 = opcode("SUB A,L", 4)(lambda self: self._sub(self.L))
-    op96 = opcode("SUB A,[HL]", 8)(lambda self: self._sub(self.MEM_AT_HL))
-    op97 = opcode("SUB A,A", 4)(lambda self: self._sub(self.A))
-
-    opD6 = opcode("SUB A,n", 8, "B")(lambda self, val: self._sub(val))
-
-    # ===================================
-    # 4. SBC n
-    def _sbc(self, val):
-        """
-        >>> c = CPU()
         >>> c.FLAG_C = True
         >>> c.A = 10
         >>> c.B = 5
-        >>> c.op98()
+        >>> c.op98()  # SBC A,B
         >>> c.A
         4
-        """
-        byte1 = self.A
-        byte2 = val
-        res = byte1 - byte2 - int(self.FLAG_C)
-        self._sub(val + int(self.FLAG_C))
-        self.FLAG_H = ((byte1 ^ byte2 ^ (res & 0xff)) & (1 << 4)) != 0
-
-    op98 = opcode("SBC A,B", 4)(lambda self: self._sbc(self.B))
-    op99 = opcode("SBC A,C", 4)(lambda self: self._sbc(self.C))
-    op9A = opcode("SBC A,D", 4)(lambda self: self._sbc(self.D))
-    op9B = opcode("SBC A,E", 4)(lambda self: self._sbc(self.E))
-    op9C = opcode("SBC A,H", 4)(lambda self: self._sbc(self.H))
-    op9D = opcode("SBC A,L", 4)(lambda self: self._sbc(self.L))
-    op9E = opcode("SBC A,[HL]", 8)(lambda self: self._sbc(self.MEM_AT_HL))
-    op9F = opcode("SBC A,A", 4)(lambda self: self._sbc(self.A))
-
-    opDE = opcode("SBC A,n", 8, "B")(lambda self, val: self._sbc(val))
 
-    # ===================================
-    # 5. AND n
-    def _and(self, val):
-        """
-        >>> c = CPU()
         >>> c.A = 0b0101
         >>> c.B = 0b0011
-        >>> c.opA0()
+        >>> c.opA0()  # AND B
         >>> f"{c.A:04b}"
         '0001'
-        """
-        self.A &= val
-        self.FLAG_Z = int(self.A == 0)
-        self.FLAG_N = False
-        self.FLAG_H = True
-        self.FLAG_C = False
-
-    opA0 = opcode("AND B", 4)(lambda self: self._and(self.B))
-    opA1 = opcode("AND C", 4)(lambda self: self._and(self.C))
-    opA2 = opcode("AND D", 4)(lambda self: self._and(self.D))
-    opA3 = opcode("AND E", 4)(lambda self: self._and(self.E))
-    opA4 = opcode("AND H", 4)(lambda self: self._and(self.H))
-    opA5 = opcode("AND L", 4)(lambda self: self._and(self.L))
-    opA6 = opcode("AND [HL]", 8)(lambda self: self._and(self.MEM_AT_HL))
-    opA7 = opcode("AND A", 4)(lambda self: self._and(self.A))
 
-    opE6 = opcode("AND n", 8, "B")(lambda self, n: self._and(n))
-
-    # ===================================
-    # 6. OR n
-    def _or(self, val):
-        """
-        >>> c = CPU()
         >>> c.A = 0b0101
         >>> c.B = 0b0011
-        >>> c.opB0()
+        >>> c.opB0()  # OR B
         >>> f"{c.A:04b}"
         '0111'
-        """
-        self.A |= val
-        self.FLAG_Z = int(self.A == 0)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_C = False
 
-    opB0 = opcode("OR B", 4)(lambda self: self._or(self.B))
-    opB1 = opcode("OR C", 4)(lambda self: self._or(self.C))
-    opB2 = opcode("OR D", 4)(lambda self: self._or(self.D))
-    opB3 = opcode("OR E", 4)(lambda self: self._or(self.E))
-    opB4 = opcode("OR H", 4)(lambda self: self._or(self.H))
-    opB5 = opcode("OR L", 4)(lambda self: self._or(self.L))
-    opB6 = opcode("OR [HL]", 8)(lambda self: self._or(self.MEM_AT_HL))
-    opB7 = opcode("OR A", 4)(lambda self: self._or(self.A))
-
-    opF6 = opcode("OR n", 8, "B")(lambda self, n: self._or(n))
-
-    # ===================================
-    # 7. XOR
-    def _xor(self, val):
-        """
-        >>> c = CPU()
         >>> c.A = 0b0101
         >>> c.B = 0b0011
-        >>> c.opA8()
+        >>> c.opA8()  # XOR B
         >>> f"{c.A:04b}"
         '0110'
         """
-        self.A ^= val
-        self.FLAG_Z = int(self.A == 0)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_C = False
-
-    opA8 = opcode("XOR B", 4)(lambda self: self._xor(self.B))
-    opA9 = opcode("XOR C", 4)(lambda self: self._xor(self.C))
-    opAA = opcode("XOR D", 4)(lambda self: self._xor(self.D))
-    opAB = opcode("XOR E", 4)(lambda self: self._xor(self.E))
-    opAC = opcode("XOR H", 4)(lambda self: self._xor(self.H))
-    opAD = opcode("XOR L", 4)(lambda self: self._xor(self.L))
-    opAE = opcode("XOR [HL]", 8)(lambda self: self._xor(self.MEM_AT_HL))
-    opAF = opcode("XOR A", 4)(lambda self: self._xor(self.A))
-
-    opEE = opcode("XOR n", 8, "B")(lambda self, n: self._xor(n))
-
-    # ===================================
-    # 8. CP
-    # Compare A with n
-    def _cp(self, n):
-        self.FLAG_Z = self.A == n
-        self.FLAG_N = True
-        self.FLAG_H = (self.A & 0x0F) < (n & 0x0F)
-        self.FLAG_C = self.A < n
-
-    opB8 = opcode("CP B", 4)(lambda self: self._cp(self.B))
-    opB9 = opcode("CP C", 4)(lambda self: self._cp(self.C))
-    opBA = opcode("CP D", 4)(lambda self: self._cp(self.D))
-    opBB = opcode("CP E", 4)(lambda self: self._cp(self.E))
-    opBC = opcode("CP H", 4)(lambda self: self._cp(self.H))
-    opBD = opcode("CP L", 4)(lambda self: self._cp(self.L))
-    opBE = opcode("CP [HL]", 8)(lambda self: self._cp(self.MEM_AT_HL))
-    opBF = opcode("CP A", 4)(lambda self: self._cp(self.A))
-
-    opFE = opcode("CP n", 8, "B")(lambda self, val: self._cp(val))
+    for base, (name, body) in enumerate([
+        ("ADD A,", "i = self.A << 8 | v; self.A = ADD_A[i]; self.F = ADD_F[i]"),
+        ("ADC A,", "i = (self.F & F_C) << 12 | self.A << 8 | v; self.A = ADD_A[i]; self.F = ADD_F[i]"),
+        ("SUB A,", "i = self.A << 8 | v; self.A = SUB_A[i]; self.F = SUB_F[i]"),
+        ("SBC A,", "i = (self.F & F_C) << 12 | self.A << 8 | v; self.A = SUB_A[i]; self.F = SUB_F[i]"),
+        ("AND ", "v &= self.A; self.A = v; self.F = Z_F[v] | F_H"),
+        ("XOR ", "v ^= self.A; self.A = v; self.F = Z_F[v]"),
+        ("OR ", "v |= self.A; self.A = v; self.F = Z_F[v]"),
+        ("CP ", "self.F = SUB_F[self.A << 8 | v]"),
+    ]):
+        for offset, reg in enumerate(GEN_REGS):
+            op = 0x80 + base * 8 + offset
+            time = 8 if reg == "[HL]" else 4
+            exec(dedent(f"""
+                @opcode("{name}{reg}", {time})
+                def op{op:02X}(self):
+                    {REG_ADDR[reg]}
+                    v = {REG_VAL[reg]}
+                    {body}
+            """))
+        op = 0xC6 + base * 8
+        exec(dedent(f"""
+            @opcode("{name}n", 8, "B")
+            def op{op:02X}(self, v):
+                {body}
+        """))
 
     # ===================================
     # 9. INC
-    def _inc8(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_H = val & 0x0F == 0x0F
-        val = (val + 1) & 0xFF
-        setattr(self, reg.value, val)
-        self.FLAG_Z = val == 0
-        self.FLAG_N = False
-
-    op04 = opcode("INC B", 4)(lambda self: self._inc8(Reg.B))
-    op0C = opcode("INC C", 4)(lambda self: self._inc8(Reg.C))
-    op14 = opcode("INC D", 4)(lambda self: self._inc8(Reg.D))
-    op1C = opcode("INC E", 4)(lambda self: self._inc8(Reg.E))
-    op24 = opcode("INC H", 4)(lambda self: self._inc8(Reg.H))
-    op2C = opcode("INC L", 4)(lambda self: self._inc8(Reg.L))
-    op34 = opcode("INC [HL]", 12)(lambda self: self._inc8(Reg.MEM_AT_HL))
-    op3C = opcode("INC A", 4)(lambda self: self._inc8(Reg.A))
+    for base, reg in enumerate(GEN_REGS):
+        op = 0x04 + base * 8
+        time = 12 if reg == "[HL]" else 4
+        exec(dedent(f"""
+            @opcode("INC {reg}", {time})
+            def op{op:02X}(self):
+                {REG_ADDR[reg]}
+                v = {REG_VAL[reg]}
+                self.F = (self.F & F_C) | INC_F[v]
+                {REG_SET[reg]} = (v + 1) & 0xFF
+        """))
 
     # ===================================
     # 10. DEC
-    def _dec8(self, reg: Reg):
-        val = getattr(self, reg.value)
-        val = (val - 1) & 0xFF
-        self.FLAG_H = val & 0x0F == 0x0F
-        setattr(self, reg.value, val)
-        self.FLAG_Z = val == 0
-        self.FLAG_N = True
-
-    op05 = opcode("DEC B", 4)(lambda self: self._dec8(Reg.B))
-    op0D = opcode("DEC C", 4)(lambda self: self._dec8(Reg.C))
-    op15 = opcode("DEC D", 4)(lambda self: self._dec8(Reg.D))
-    op1D = opcode("DEC E", 4)(lambda self: self._dec8(Reg.E))
-    op25 = opcode("DEC H", 4)(lambda self: self._dec8(Reg.H))
-    op2D = opcode("DEC L", 4)(lambda self: self._dec8(Reg.L))
-    op35 = opcode("DEC [HL]", 12)(lambda self: self._dec8(Reg.MEM_AT_HL))
-    op3D = opcode("DEC A", 4)(lambda self: self._dec8(Reg.A))
+    for base, reg in enumerate(GEN_REGS):
+        op = 0x05 + base * 8
+        time = 12 if reg == "[HL]" else 4
+        exec(dedent(f"""
+            @opcode("DEC {reg}", {time})
+            def op{op:02X}(self):
+                {REG_ADDR[reg]}
+                v = {REG_VAL[reg]}
+                self.F = (self.F & F_C) | DEC_F[v]
+                {REG_SET[reg]} = (v - 1) & 0xFF
+        """))
     # </editor-fold>
 
     # <editor-fold description="3.3.4 16-Bit Arithmetic">
 
     # ===================================
     # 1. ADD HL,nn
-    def _add_hl(self, val):
-        self.FLAG_H = ((self.HL & 0x0fff) + (val & 0x0fff) > 0x0fff)
-        self.FLAG_C = (self.HL + val > 0xffff)
-        self.HL += val
-        self.HL &= 0xFFFF
-        self.FLAG_N = False
-
-    op09 = opcode("ADD HL,BC", 8)(lambda self: self._add_hl(self.BC))
-    op19 = opcode("ADD HL,DE", 8)(lambda self: self._add_hl(self.DE))
-    op29 = opcode("ADD HL,HL", 8)(lambda self: self._add_hl(self.HL))
-    op39 = opcode("ADD HL,SP", 8)(lambda self: self._add_hl(self.SP))
+    for base, pair in enumerate(["BC", "DE", "HL", "SP"]):
+        op = 0x09 + base * 0x10
+        exec(dedent(f"""
+            @opcode("ADD HL,{pair}", 8)
+            def op{op:02X}(self):
+                hl = self.H << 8 | self.L
+                val = {PAIR_VAL[pair]}
+                self.F = (
+                    (self.F & F_Z) |
+                    (F_H if (hl & 0x0fff) + (val & 0x0fff) > 0x0fff else 0) |
+                    (F_C if hl + val > 0xffff else 0)
+                )
+                v = (hl + val) & 0xFFFF
+                self.H, self.L = v >> 8, v & 0xFF
+        """))
 
     # ===================================
     # 2. ADD SP,n
     @opcode("ADD SP n", 16, "b")
     def opE8(self, val):
         tmp = self.SP + val
-        self.FLAG_H = bool((self.SP ^ val ^ tmp) & 0x10)
-        self.FLAG_C = bool((self.SP ^ val ^ tmp) & 0x100)
-        self.SP += val
-        self.SP &= 0xFFFF
-        self.FLAG_Z = False
-        self.FLAG_N = False
+        self.F = (
+            (F_H if (self.SP ^ val ^ tmp) & 0x10 else 0) |
+            (F_C if (self.SP ^ val ^ tmp) & 0x100 else 0)
+        )
+        self.SP = tmp & 0xFFFF
 
     # ===================================
     # 3. INC nn
-    def _inc16(self, reg):
-        val = getattr(self, reg)
-        val = (val + 1) & 0xFFFF
-        setattr(self, reg, val)
-
-    op03 = opcode("INC BC", 8)(lambda self: self._inc16("BC"))
-    op13 = opcode("INC DE", 8)(lambda self: self._inc16("DE"))
-    op23 = opcode("INC HL", 8)(lambda self: self._inc16("HL"))
-    op33 = opcode("INC SP", 8)(lambda self: self._inc16("SP"))
+    for base, pair in enumerate(["BC", "DE", "HL", "SP"]):
+        op = 0x03 + base * 0x10
+        exec(dedent(f"""
+            @opcode("INC {pair}", 8)
+            def op{op:02X}(self):
+                v = ({PAIR_VAL[pair]} + 1) & 0xFFFF
+                {PAIR_SET[pair]}
+        """))
 
     # ===================================
     # 4. DEC nn
-    def _dec16(self, reg):
-        val = getattr(self, reg)
-        val = (val - 1) & 0xFFFF
-        setattr(self, reg, val)
-
-    op0B = opcode("DEC BC", 8)(lambda self: self._dec16("BC"))
-    op1B = opcode("DEC DE", 8)(lambda self: self._dec16("DE"))
-    op2B = opcode("DEC HL", 8)(lambda self: self._dec16("HL"))
-    op3B = opcode("DEC SP", 8)(lambda self: self._dec16("SP"))
+    for base, pair in enumerate(["BC", "DE", "HL", "SP"]):
+        op = 0x0B + base * 0x10
+        exec(dedent(f"""
+            @opcode("DEC {pair}", 8)
+            def op{op:02X}(self):
+                v = ({PAIR_VAL[pair]} - 1) & 0xFFFF
+                {PAIR_SET[pair]}
+        """))
 
     # </editor-fold>
 
     # <editor-fold description="3.3.5 Miscellaneous">
     # ===================================
     # 1. SWAP
-    # FIXME: CB36 takes 16 cycles, not 8
-    def _swap(self, reg: Reg):
-        val = getattr(self, reg.value)
-        val = ((val & 0xF0) >> 4) | ((val & 0x0F) << 4)
-        setattr(self, reg.value, val)
-        self.FLAG_Z = val == 0
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_C = False
+    # (see 3.3.6 for the CB-prefixed implementation)
 
     # ===================================
     # 2. DAA
@@ -954,29 +1782,9 @@ class CPU:
         >>> bin(c.A)
         '0b11000010'
         """
-        tmp = self.A
-
-        if self.FLAG_N == 0:
-            if self.FLAG_H or (tmp & 0x0F) > 9:
-                tmp += 6
-            if self.FLAG_C or tmp > 0x9F:
-                tmp += 0x60
-        else:
-            if self.FLAG_H:
-                tmp -= 6
-                if self.FLAG_C == 0:
-                    tmp &= 0xFF
-
-            if self.FLAG_C:
-                tmp -= 0x60
-
-        self.FLAG_H = False
-        self.FLAG_Z = False
-        if tmp & 0x100:
-            self.FLAG_C = True
-        self.A = tmp & 0xFF
-        if self.A == 0:
-            self.FLAG_Z = True
+        i = (self.F & 0x70) << 4 | self.A
+        self.A = DAA_A[i]
+        self.F = DAA_F[i]
 
     # ===================================
     # 3. CPL
@@ -991,8 +1799,7 @@ class CPU:
         '0b1010101'
         """
         self.A ^= 0xFF
-        self.FLAG_N = True
-        self.FLAG_H = True
+        self.F |= F_N | F_H
 
     # ===================================
     # 4. CCF
@@ -1008,9 +1815,7 @@ class CPU:
         >>> c.FLAG_C
         False
         """
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_C = not self.FLAG_C
+        self.F = (self.F & (F_Z | F_C)) ^ F_C
 
     # ===================================
     # 5. SCF
@@ -1023,9 +1828,7 @@ class CPU:
         >>> c.FLAG_C
         True
         """
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_C = True
+        self.F = (self.F & F_Z) | F_C
 
     # ===================================
     # 6. NOP
@@ -1040,6 +1843,7 @@ class CPU:
     @opcode("HALT", 0)  # doc says 4
     def op76(self):
         self.halt = True
+        self._deadline = 0
         # FIXME: weird instruction skipping behaviour when interrupts are disabled
 
     # ===================================
@@ -1050,6 +1854,7 @@ class CPU:
     def op10(self, sub):  # 10 00
         if sub == 00:
             self.stop = True
+            self._deadline = 0
         else:
             raise OpNotImplemented("Missing sub-command 10:%02X" % sub)
 
@@ -1066,19 +1871,61 @@ class CPU:
     def opFB(self):
         # FIXME: supposed to take effect after the following instruction
         self.interrupts = True
+        self._deadline = 0
 
     # </editor-fold>
 
     # <editor-fold description="3.3.6 Rotates & Shifts">
-    for base, ins in enumerate(["RLC", "RRC", "RL", "RR", "SLA", "SRA", "SWAP", "SRL"]):
+    # 5. RLC
+    # 6. RL
+    # 7. RRC
+    # 8. RR
+    # 9. SLA
+    # 10. SRA
+    # 11. SRL
+    # (and SWAP from 3.3.5)
+    # Templates set `c` to the new carry flag and `v` to the result
+    def _test_rl(self):
+        """
+        >>> c = CPU()
+        >>> c.A = 0xAA
+        >>> c.FLAG_C = True
+
+        >>> c.opCB17()  # RL A
+        >>> hex(c.A), c.FLAG_C
+        ('0x55', True)
+        >>> c.opCB17()
+        >>> hex(c.A), c.FLAG_C
+        ('0xab', False)
+        >>> c.opCB17()
+        >>> hex(c.A), c.FLAG_C
+        ('0x56', True)
+        >>> c.opCB17()
+        >>> hex(c.A), c.FLAG_C
+        ('0xad', False)
+        """
+    for base, (ins, body) in enumerate([
+        ("RLC", "c = (v >> 3) & F_C; v = ((v << 1) | (v >> 7)) & 0xFF"),
+        ("RRC", "c = (v << 4) & F_C; v = (v >> 1) | ((v << 7) & 0xFF)"),
+        ("RL", "c = (v >> 3) & F_C; v = ((v << 1) | (self.F >> 4 & 1)) & 0xFF"),
+        ("RR", "c = (v << 4) & F_C; v = (v >> 1) | ((self.F & F_C) << 3)"),
+        ("SLA", "c = (v >> 3) & F_C; v = (v << 1) & 0xFF"),
+        ("SRA", "c = (v << 4) & F_C; v = (v >> 1) | (v & 0b10000000)"),
+        # FIXME: CB36 takes 16 cycles, not 8
+        ("SWAP", "c = 0; v = ((v & 0xF0) >> 4) | ((v & 0x0F) << 4)"),
+        ("SRL", "c = (v << 4) & F_C; v >>= 1"),
+    ]):
         for offset, reg in enumerate(GEN_REGS):
             op = (base * 8) + offset
             time = 16 if reg == "[HL]" else 8
-            regn = reg.replace("[HL]", "MEM_AT_HL")
             exec(dedent(f"""
                 @opcode("{ins} {reg}", {time})
                 def opCB{op:02X}(self):
-                    self._{ins.lower()}(Reg.{regn})
+                    {REG_ADDR[reg]}
+                    v = {REG_VAL[reg]}
+                    {body}
+                    {REG_SET[reg]} = v
+                    self.F = Z_F[v] | c
             """))
 
     # ===================================
@@ -1093,11 +1940,8 @@ class CPU:
         >>> bin(c.A), c.FLAG_C
         ('0b1010100', True)
         """
-        self.FLAG_C = (self.A & 0b10000000) != 0
+        self.F = (self.A >> 3) & F_C
         self.A = ((self.A << 1) | (self.A >> 7)) & 0xFF
-        self.FLAG_Z = False
-        self.FLAG_N = False
-        self.FLAG_H = False
 
     # ===================================
     # 2. RLA
@@ -1111,12 +1955,9 @@ class CPU:
         >>> bin(c.A), c.FLAG_C
         ('0b1010101', True)
         """
-        old_c = self.FLAG_C
-        self.FLAG_C = (self.A & 0b10000000) != 0
+        old_c = (self.F >> 4) & 1
+        self.F = (self.A >> 3) & F_C
         self.A = ((self.A << 1) | old_c) & 0xFF
-        self.FLAG_Z = False
-        self.FLAG_N = False
-        self.FLAG_H = False
 
     # ===================================
     # 3. RRCA
@@ -1130,11 +1971,8 @@ class CPU:
         >>> bin(c.A), c.FLAG_C
         ('0b1010101', False)
         """
-        self.FLAG_C = (self.A & 0b00000001) != 0
+        self.F = (self.A << 4) & F_C
         self.A = ((self.A >> 1) | (self.A << 7)) & 0xFF
-        self.FLAG_Z = False
-        self.FLAG_N = False
-        self.FLAG_H = False
 
     # ===================================
     # 4. RRA
@@ -1148,119 +1986,9 @@ class CPU:
         >>> bin(c.A), c.FLAG_C
         ('0b11010101', False)
         """
-        old_c = self.FLAG_C
-        self.FLAG_C = (self.A & 0b00000001) != 0
-        self.A = (self.A >> 1) | (old_c << 7)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = False
-
-    # ===================================
-    # 5. RLC
-    def _rlc(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0b10000000)
-        val <<= 1
-        if self.FLAG_C:
-            val |= 1
-        val &= 0xFF
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 6. RL
-    def _rl(self, reg: Reg):
-        """
-        >>> c = CPU()
-        >>> c.A = 0xAA
-        >>> c.FLAG_C = True
-
-        >>> c._rl(Reg.A)
-        >>> hex(c.A), c.FLAG_C
-        ('0x55', True)
-        >>> c._rl(Reg.A)
-        >>> hex(c.A), c.FLAG_C
-        ('0xab', False)
-        >>> c._rl(Reg.A)
-        >>> hex(c.A), c.FLAG_C
-        ('0x56', True)
-        >>> c._rl(Reg.A)
-        >>> hex(c.A), c.FLAG_C
-        ('0xad', False)
-        """
-        orig_c = self.FLAG_C
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0b10000000)
-        val = ((val << 1) | orig_c) & 0xFF
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 7. RRC
-    def _rrc(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0x1)
-        val >>= 1
-        if self.FLAG_C:
-            val |= 0b10000000
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 8. RR
-    def _rr(self, reg: Reg):
-        orig_c = self.FLAG_C
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0x1)
-        val >>= 1
-        if orig_c:
-            val |= 1 << 7
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 9. SLA
-    def _sla(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0b10000000)
-        val <<= 1
-        val &= 0xFF
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 10. SRA
-    def _sra(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0x1)
-        val >>= 1
-        if val & 0b01000000:
-            val |= 0b10000000
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
-
-    # ===================================
-    # 11. SRL
-    def _srl(self, reg: Reg):
-        val = getattr(self, reg.value)
-        self.FLAG_C = bool(val & 0x1)
-        val >>= 1
-        setattr(self, reg.value, val)
-        self.FLAG_N = False
-        self.FLAG_H = False
-        self.FLAG_Z = val == 0
+        old_c = self.F & F_C
+        self.F = (self.A << 4) & F_C
+        self.A = (self.A >> 1) | (old_c << 3)
 
     # </editor-fold>
 
@@ -1289,13 +2017,11 @@ class CPU:
         for offset, reg in enumerate(GEN_REGS):
             op = 0x40 + b * 0x08 + offset
             time = 16 if reg == "[HL]" else 8
-            arg = reg.replace("[HL]", "MEM_AT_HL")
             exec(dedent(f"""
                 @opcode("BIT {b},{reg}", {time})
                 def opCB{op:02X}(self):
-                    self.FLAG_Z = not bool(self.{arg} & (1 << {b}))
-                    self.FLAG_N = False
-                    self.FLAG_H = True
+                    {REG_ADDR[reg]}
+                    self.F = (self.F & F_C) | F_H | ((~{REG_VAL[reg]} << {7 - b}) & F_Z)
             """))
 
     # ===================================
@@ -1304,11 +2030,11 @@ class CPU:
         for offset, arg in enumerate(GEN_REGS):
             op = 0x80 + b * 0x08 + offset
             time = 16 if arg == "[HL]" else 8
-            arg = arg.replace("[HL]", "MEM_AT_HL")
             exec(dedent(f"""
                 @opcode("RES {b},{arg}", {time})
                 def opCB{op:02X}(self):
-                    self.{arg} &= ((0x01 << {b}) ^ 0xFF)
+                    {REG_ADDR[arg]}
+                    {REG_SET[arg]} = {REG_VAL[arg]} & {(0x01 << b) ^ 0xFF}
             """))
 
     # ===================================
@@ -1317,11 +2043,11 @@ class CPU:
         for offset, arg in enumerate(GEN_REGS):
             op = 0xC0 + b * 0x08 + offset
             time = 16 if arg == "[HL]" else 8
-            arg = arg.replace("[HL]", "MEM_AT_HL")
             exec(dedent(f"""
                 @opcode("SET {b},{arg}", {time})
                 def opCB{op:02X}(self):
-                    self.{arg} |= (0x01 << {b})
+                    {REG_ADDR[arg]}
+                    {REG_SET[arg]} = {REG_VAL[arg]} | {0x01 << b}
             """))
 
     # </editor-fold>
@@ -1331,6 +2057,8 @@ class CPU:
     # 1. JP nn
     @opcode("JP nn", 16, "H")  # doc says 12
     def opC3(self, nn):
+        if nn < self.PC:
+            self._loop(nn, self.PC)
         self.PC = nn
 
     # ===================================
@@ -1338,22 +2066,30 @@ class CPU:
     # Absolute jump if given flag is not set / set
     @opcode("JP NZ,n", 12, "H")
     def opC2(self, n):
-        if not self.FLAG_Z:
+        if not self.F & F_Z:
+            if n < self.PC:
+                self._loop(n, self.PC)
             self.PC = n
 
     @opcode("JP Z,n", 12, "H")
     def opCA(self, n):
-        if self.FLAG_Z:
+        if self.F & F_Z:
+            if n < self.PC:
+                self._loop(n, self.PC)
             self.PC = n
 
     @opcode("JP NC,n", 12, "H")
     def opD2(self, n):
-        if not self.FLAG_C:
+        if not self.F & F_C:
+            if n < self.PC:
+                self._loop(n, self.PC)
             self.PC = n
 
     @opcode("JP C,n", 12, "H")
     def opDA(self, n):
-        if self.FLAG_C:
+        if self.F & F_C:
+            if n < self.PC:
+                self._loop(n, self.PC)
             self.PC = n
 
     # ===================================
@@ -1361,12 +2097,22 @@ class CPU:
     @opcode("JP HL", 4)
     def opE9(self):
         # ERROR: docs say this is [HL], not HL...
-        self.PC = self.HL
+        self.PC = self.H << 8 | self.L
 
     # ===================================
     # 4. JR n
     @opcode("JR n", 12, "b")  # doc says 8
     def op18(self, n):
+        """
+        >>> c = CPU()
+        >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+        >>> c.ram[0xC080:0xC082] = [0x18, 0x80]  # JR -128
+        >>> c.PC = 0xC080
+        >>> c.tick(), hex(c.PC)
+        (12, '0xc002')
+        """
+        if n < 0:
+            self._loop(self.PC + n, self.PC)
         self.PC += n
 
     # ===================================
@@ -1374,22 +2120,30 @@ class CPU:
     # Relative jump if given flag is not set / set
     @opcode("JR NZ,n", 8, "b")
     def op20(self, n):
-        if not self.FLAG_Z:
+        if not self.F & F_Z:
+            if n < 0:
+                self._loop(self.PC + n, self.PC)
             self.PC += n
 
     @opcode("JR Z,n", 8, "b")
     def op28(self, n):
-        if self.FLAG_Z:
+        if self.F & F_Z:
+            if n < 0:
+                self._loop(self.PC + n, self.PC)
             self.PC += n
 
     @opcode("JR NC,n", 8, "b")
     def op30(self, n):
-        if not self.FLAG_C:
+        if not self.F & F_C:
+            if n < 0:
+                self._loop(self.PC + n, self.PC)
             self.PC += n
 
     @opcode("JR C,n", 8, "b")
     def op38(self, n):
-        if self.FLAG_C:
+        if self.F & F_C:
+            if n < 0:
+                self._loop(self.PC + n, self.PC)
             self.PC += n
     # </editor-fold>
 
@@ -1398,7 +2152,11 @@ class CPU:
     # 1. CALL nn
     @opcode("CALL nn", 24, "H")  # doc says 12
     def opCD(self, nn):
-        self._push16(Reg.PC)
+        sp = self.SP - 1
+        self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+        sp -= 1
+        self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+        self.SP = sp
         self.PC = nn
 
     # ===================================
@@ -1406,26 +2164,42 @@ class CPU:
     # Absolute call if given flag is not set / set
     @opcode("CALL NZ,nn", 12, "H")
     def opC4(self, n):
-        if not self.FLAG_Z:
-            self._push16(Reg.PC)
+        if not self.F & F_Z:
+            sp = self.SP - 1
+            self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+            sp -= 1
+            self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+            self.SP = sp
             self.PC = n
 
     @opcode("CALL Z,nn", 12, "H")
     def opCC(self, n):
-        if self.FLAG_Z:
-            self._push16(Reg.PC)
+        if self.F & F_Z:
+            sp = self.SP - 1
+            self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+            sp -= 1
+            self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+            self.SP = sp
             self.PC = n
 
     @opcode("CALL NC,nn", 12, "H")
     def opD4(self, n):
-        if not self.FLAG_C:
-            self._push16(Reg.PC)
+        if not self.F & F_C:
+            sp = self.SP - 1
+            self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+            sp -= 1
+            self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+            self.SP = sp
             self.PC = n
 
     @opcode("CALL C,nn", 12, "H")
     def opDC(self, n):
-        if self.FLAG_C:
-            self._push16(Reg.PC)
+        if self.F & F_C:
+            sp = self.SP - 1
+            self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+            sp -= 1
+            self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+            self.SP = sp
             self.PC = n
 
     # </editor-fold>
@@ -1436,19 +2210,18 @@ class CPU:
     # Push present address onto stack.
     # Jump to address $0000 + n.
     # n = $00,$08,$10,$18,$20,$28,$30,$38
-    def _rst(self, val):
-        self._push16(Reg.PC)
-        self.PC = val
-
     # doc says 32 cycles, test says 16
-    opC7 = opcode("RST 00", 16)(lambda self: self._rst(0x00))
-    opCF = opcode("RST 08", 16)(lambda self: self._rst(0x08))
-    opD7 = opcode("RST 10", 16)(lambda self: self._rst(0x10))
-    opDF = opcode("RST 18", 16)(lambda self: self._rst(0x18))
-    opE7 = opcode("RST 20", 16)(lambda self: self._rst(0x20))
-    opEF = opcode("RST 28", 16)(lambda self: self._rst(0x28))
-    opF7 = opcode("RST 30", 16)(lambda self: self._rst(0x30))
-    opFF = opcode("RST 38", 16)(lambda self: self._rst(0x38))
+    for val in range(0x00, 0x40, 0x08):
+        exec(dedent(f"""
+            @opcode("RST {val:02X}", 16)
+            def op{0xC7 + val:02X}(self):
+                sp = self.SP - 1
+                self._wr[sp >> 8][sp & 0xFF] = (self.PC >> 8) & 0xFF
+                sp -= 1
+                self._wr[sp >> 8][sp & 0xFF] = self.PC & 0xFF
+                self.SP = sp
+                self.PC = 0x{val:04X}
+        """))
     # </editor-fold>
 
     # <editor-fold description="3.3.11 Returns">
@@ -1457,35 +2230,60 @@ class CPU:
     # 1. RET
     @opcode("RET", 16)  # doc says 8
     def opC9(self):
-        self._pop16(Reg.PC)
+        sp = self.SP
+        lo = self._rd[sp >> 8][sp & 0xFF]
+        sp += 1
+        self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+        self.SP = sp + 1
 
     # ===================================
     # 2. RET cc
     @opcode("RET NZ", 8)
     def opC0(self):
-        if not self.FLAG_Z:
-            self._pop16(Reg.PC)
+        if not self.F & F_Z:
+            sp = self.SP
+            lo = self._rd[sp >> 8][sp & 0xFF]
+            sp += 1
+            self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+            self.SP = sp + 1
 
     @opcode("RET Z", 8)
     def opC8(self):
-        if self.FLAG_Z:
-            self._pop16(Reg.PC)
+        if self.F & F_Z:
+            sp = self.SP
+            lo = self._rd[sp >> 8][sp & 0xFF]
+            sp += 1
+            self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+            self.SP = sp + 1
 
     @opcode("RET NC", 8)
     def opD0(self):
-        if not self.FLAG_C:
-            self._pop16(Reg.PC)
+        if not self.F & F_C:
+            sp = self.SP
+            lo = self._rd[sp >> 8][sp & 0xFF]
+            sp += 1
+            self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+            self.SP = sp + 1
 
     @opcode("RET C", 8)
     def opD8(self):
-        if self.FLAG_C:
-            self._pop16(Reg.PC)
+        if self.F & F_C:
+            sp = self.SP
+            lo = self._rd[sp >> 8][sp & 0xFF]
+            sp += 1
+            self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+            self.SP = sp + 1
 
     # ===================================
     # 3. RETI
     @opcode("RETI", 16)  # doc says 8
     def opD9(self):
-        self._pop16(Reg.PC)
+        sp = self.SP
+        lo = self._rd[sp >> 8][sp & 0xFF]
+        sp += 1
+        self.PC = self._rd[sp >> 8][sp & 0xFF] << 8 | lo
+        self.SP = sp + 1
         self.interrupts = True
+        self._deadline = 0
 
     # </editor-fold>
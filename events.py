@@ -0,0 +1,84 @@
+import heapq
+
+
+class Scheduler:
+    """
+    Things which need to happen at a given cycle count (VBlank, timer
+    overflow, a serial transfer finishing, ...), kept in a priority queue
+    so that the CPU can run flat out until the next one is due, and skip
+    straight to it when halted.
+
+    Each event has a name, and scheduling an event replaces any pending
+    one with the same name. Callbacks get the cycle they were due at;
+    `now` holds the cycle they actually ran at, which is later if the
+    CPU was in the middle of an instruction or block.
+
+    >>> s = Scheduler()
+    >>> s.at(100, "b", print)
+    >>> s.at(50, "a", print)
+    >>> s.next
+    50
+    >>> s.at(70, "a", print)
+    >>> s.run_due(120)
+    70
+    100
+    >>> s.next
+    inf
+    >>> s.at(10, "a", print)
+    >>> s.cancel("a")
+    >>> s.next
+    inf
+    """
+    __slots__ = ("_heap", "_live", "_seq", "next", "now")
+
+    def __init__(self):
+        self._heap = []
+        self._live = {}
+        self._seq = 0
+        self.next = float("inf")
+        self.now = 0
+
+    def at(self, when, name, fn):
+        self.cancel(name)
+        self._seq += 1
+        event = [when, self._seq, name, fn]
+        self._live[name] = event
+        heapq.heappush(self._heap, event)
+        if when < self.next:
+            self.next = when
+
+    def cancel(self, name):
+        event = self._live.pop(name, None)
+        if event:
+            event[3] = None
+            self._settle()
+
+    def pending(self, name):
+        """
+        When the event `name` is due, or None
+
+        >>> s = Scheduler()
+        >>> s.at(100, "a", print)
+        >>> s.pending("a"), s.pending("b")
+        (100, None)
+        """
+        event = self._live.get(name)
+        return event[0] if event else None
+
+    def run_due(self, now):
+        self.now = now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            when, _, name, fn = heapq.heappop(heap)
+            if fn:
+                del self._live[name]
+                fn(when)
+        self._settle()
+
+    def _settle(self):
+        # drop cancelled events off the top of the heap, so that `next`
+        # is always a live one
+        heap = self._heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+        self.next = heap[0][0] if heap else float("inf")
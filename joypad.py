@@ -0,0 +1,81 @@
+# Bits of the pressed-buttons mask: the d-pad in the bottom nibble and
+# the buttons in the top one, in the order P1 shows them in
+BUTTONS = {
+    "right": 0x01, "left": 0x02, "up": 0x04, "down": 0x08,
+    "a": 0x10, "b": 0x20, "select": 0x40, "start": 0x80,
+}
+
+# P1 bits which pick the d-pad / the buttons, when they're 0
+P1_DPAD = 0x10
+P1_BUTTONS = 0x20
+
+
+class Joypad:
+    """
+    P1 (0xFF00), and the joypad interrupt.
+
+    The game picks the d-pad and / or the buttons by writing 0 to bit 4
+    and / or bit 5, then reads them back in the bottom 4 bits, 0 meaning
+    pressed. Whenever one of those lines goes from 1 to 0, because of a
+    press or because the game picked a group with something held down,
+    `interrupt()` gets called and the CPU comes out of STOP.
+
+    >>> from cart import Cart, rom_image
+    >>> from cpu import CPU
+    >>> c = CPU(Cart(rom_image()))
+    >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+    >>> c.ram[0xC000:0xC003] = [0x10, 0x00, 0x3C]  # STOP; INC A
+    >>> c.PC, c.A = 0xC000, 0
+    >>> c.mmu.write(0xFF00, P1_BUTTONS)  # just the d-pad
+    >>> c.run(1000)
+    (1000, <Exit.STOP: 'stop'>)
+    >>> c.joypad.press("down")
+    >>> hex(c.mmu.read(0xFF00)), c.stop, hex(c.ram[0xFF0F])
+    ('0xe7', False, '0x10')
+    >>> c.run(4)
+    (4, <Exit.CYCLES: 'cycles'>)
+    >>> c.A
+    1
+    """
+    def __init__(self, cpu, interrupt):
+        self.cpu = cpu
+        self.interrupt = interrupt
+        self.io = cpu.mmu.io
+        # BUTTONS which are held down
+        self.pressed = 0
+        # nothing picked
+        self.io.mem[0x00] = P1_DPAD | P1_BUTTONS
+
+        self.io.on_read[0x00] = self.read_p1
+        self.io.on_write[0x00] = self.write_p1
+
+    def _lines(self):
+        # the bottom 4 bits of P1, 0 for pressed
+        select = self.io.mem[0x00]
+        lines = 0x0F
+        if not select & P1_DPAD:
+            lines &= ~self.pressed
+        if not select & P1_BUTTONS:
+            lines &= ~(self.pressed >> 4)
+        return lines
+
+    def _changed(self, before):
+        if before & ~self._lines():
+            self.interrupt()
+            self.cpu.stop = False
+
+    def read_p1(self):
+        return 0xC0 | self.io.mem[0x00] | self._lines()
+
+    def write_p1(self, val):
+        before = self._lines()
+        self.io.mem[0x00] = val & (P1_DPAD | P1_BUTTONS)
+        self._changed(before)
+
+    def press(self, button):
+        before = self._lines()
+        self.pressed |= BUTTONS[button]
+        self._changed(before)
+
+    def release(self, button):
+        self.pressed &= ~BUTTONS[button]
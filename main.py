@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import json
 from typing import List
 from cart import Cart
-from cpu import CPU, OpNotImplemented
-from lcd import LCD
+from cpu import CPU, OpNotImplemented, CYCLES_PER_FRAME
+from callgraph import load_sym
+from ppu import pgm
 import argparse
 
 
 def info(cart):
-    with open(cart, "rb") as fp:
-        data = fp.read()
-    cart = Cart(data)
+    cart = Cart.open(cart)
     print(cart)
     # cpu = cpu.CPU(cart)
     # print("%d%% of instructions implemented" % (sum(op is not None for op in cpu.ops)/256*100))
@@ -20,30 +21,22 @@ def info(cart):
 
 
 def run(args):
-    with open(args.cart, "rb") as fp:
-        data = fp.read()
-    cart = Cart(data)
-    cpu = CPU(cart, debug=args.debug_cpu)
+    cart = Cart.open(args.cart)
+    save = os.path.splitext(args.cart)[0] + ".sav"
+    cpu = CPU(cart, debug=args.debug_cpu, jit=args.jit, trace=args.trace, save=save)
 
+    # pygame only gets loaded for a window; headless runs still draw
+    # frames, into cpu.ppu.frame
     lcd = None
     if not args.headless:
+        from lcd import LCD
         lcd = LCD(cpu, debug=args.debug_gpu)
 
     running = True
-    clock = 0
+    frames = 0
     while running:
         try:
-            if not cpu.halt and not cpu.stop:
-                clock += cpu.tick()
-            else:
-                clock += 4
-            #if cpu.halt:
-            #    print("CPU halted, waiting for interrupt")
-            #    break
-            #if cpu.stop:
-            #    print("CPU stopped, waiting for button")
-            #    break
-
+            cpu.run(CYCLES_PER_FRAME)
         except OpNotImplemented as e:
             running = False
             # print(cpu)
@@ -52,25 +45,62 @@ def run(args):
             running = False
             dump(cpu, str(e))
 
-        # 4MHz / 60FPS ~= 70000 instructions per frame
-        if clock > 70224 or clock > 1000:
-            # print(last_frame - time.time())
-            clock = 0
-            if lcd and not lcd.update():
-                running = False
+        if lcd and not lcd.update():
+            running = False
+        frames += 1
+        if args.frames and frames >= args.frames:
+            running = False
 
     if lcd:
         lcd.close()
+    cpu.mbc.close()
+
+    if args.screenshot:
+        with open(args.screenshot, "wb") as fp:
+            fp.write(pgm(cpu.ppu.frame))
+
+    if args.stats:
+        for key, val in cpu.stats.items():
+            print("%s: %d" % (key, val), file=sys.stderr)
+
+
+def profile(args):
+    cart = Cart.open(args.cart)
+    cpu = CPU(cart, trace=args.trace, profile=True, callgraph=True)
+
+    sym = args.sym or os.path.splitext(args.cart)[0] + ".sym"
+    if args.sym or os.path.exists(sym):
+        cpu.callgraph.symbols = load_sym(sym)
+
+    try:
+        for _ in range(args.frames):
+            cpu.run(CYCLES_PER_FRAME)
+    except OpNotImplemented as e:
+        print(e, file=sys.stderr)
+    except (Exception, KeyboardInterrupt) as e:
+        dump(cpu, str(e))
+
+    print(cpu.profile.report(cpu, args.top))
+    print()
+    print(cpu.callgraph.report(args.top))
+    with open(args.json, "w") as fp:
+        report = cpu.profile.to_json(cpu)
+        report["frames"] = args.frames
+        json.dump(report, fp, indent=2)
+    with open(args.collapsed, "w") as fp:
+        fp.write("\n".join(cpu.callgraph.collapsed()) + "\n")
+    print("\nFull report written to %s, call stacks to %s" % (args.json, args.collapsed))
 
 
 def dump(cpu: CPU, err: str):
     print("Error: %s\nWriting details to crash.txt" % err)
     with open("crash.txt", "w") as fp:
         fp.write(str(err) + "\n\n")
-        fp.write(str(cpu._debug_str) + "\n\n")
+        fp.write("\n".join(cpu.format_trace()) + "\n\n")
         fp.write(str(cpu) + "\n\n")
+        mem = cpu.mmu.snapshot()
         for n in range(0x0000, 0xFFFF, 0x0010):
-            fp.write(("%04X :" + (" %02X" * 16) + "\n") % (n, *cpu.ram[n:n + 0x0010]))
+            fp.write(("%04X :" + (" %02X" * 16) + "\n") % (n, *mem[n:n + 0x0010]))
 
 
 def main(argv: List[str]) -> int:
@@ -80,6 +110,23 @@ def main(argv: List[str]) -> int:
     parser.add_argument("-d", "--debug-cpu", action="store_true", default=False)
     parser.add_argument("-D", "--debug-gpu", action="store_true", default=False)
     parser.add_argument("--headless", action="store_true", default=False)
+    parser.add_argument("--jit", action="store_true", default=False)
+    parser.add_argument("--trace", type=int, default=0, metavar="N",
+                        help="keep the last N instructions for crash dumps")
+    parser.add_argument("--stats", action="store_true", default=False,
+                        help="print emulator counters on exit")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="how many frames to run (or profile, default 600) for")
+    parser.add_argument("--screenshot", default=None, metavar="FILE",
+                        help="write the last frame to FILE as a PGM image on exit")
+    parser.add_argument("--top", type=int, default=20,
+                        help="how many rows of each profile table to print")
+    parser.add_argument("--json", default="profile.json",
+                        help="where to write the full profile")
+    parser.add_argument("--collapsed", default="profile.folded",
+                        help="where to write call stacks, for flamegraph tools")
+    parser.add_argument("--sym", default=None,
+                        help="symbol file (default: <rom>.sym, if it exists)")
     args = parser.parse_args()
 
     if args.mode == "info":
@@ -88,6 +135,11 @@ def main(argv: List[str]) -> int:
     if args.mode == "run":
         run(args)
 
+    if args.mode == "profile":
+        if args.frames is None:
+            args.frames = 600
+        profile(args)
+
     return 0
 
 
@@ -0,0 +1,470 @@
+import mmap
+import os
+import struct
+import time
+from cart import Cart, CartType
+from mmu import MMU, UNMAPPED, WriteHook
+
+CLOCK_HZ = 4194304
+
+# The clock's state as BGB and most other emulators save it after the
+# RAM: S, M, H, DL, DH as they are and as latched, then a unix timestamp
+RTC_FORMAT = "<10IQ"
+RTC_BYTES = struct.calcsize(RTC_FORMAT)
+
+
+class RTC:
+    """
+    MBC3's real-time clock, which counts seconds, minutes, hours and
+    days (up to 511, then the carry bit gets set).
+
+    It's kept as a count of seconds as of some point in emulated time,
+    `clock()` cycles since power on, and the registers are only worked
+    out from that when the game latches them; nothing happens as time
+    passes.
+
+    >>> now = [0]
+    >>> rtc = RTC(lambda: now[0])
+    >>> now[0] = (86400 + 3661) * CLOCK_HZ
+    >>> rtc.latch(0); rtc.latch(1)
+    >>> list(rtc.latched)
+    [1, 1, 1, 1, 0]
+    >>> rtc.write(0x0C, 0x40)  # halt
+    >>> now[0] += 60 * CLOCK_HZ
+    >>> rtc.latch(0); rtc.latch(1)
+    >>> list(rtc.latched)
+    [1, 1, 1, 1, 64]
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.secs = 0
+        self.cycles = clock()
+        self.halted = False
+        self.carry = False
+        self.latched = bytearray(5)
+        self._latch_armed = False
+
+    def registers(self):
+        """
+        [S, M, H, DL, DH] as of now
+        """
+        secs = self.secs
+        if not self.halted:
+            secs += (self.clock() - self.cycles) // CLOCK_HZ
+        days = secs // 86400
+        if days > 0x1FF:
+            self.carry = True
+            days &= 0x1FF
+        return [
+            secs % 60, secs // 60 % 60, secs // 3600 % 24,
+            days & 0xFF, days >> 8 | self.halted << 6 | self.carry << 7,
+        ]
+
+    def latch(self, val):
+        # writing 0 then 1 copies the clock into the registers
+        if val == 1 and self._latch_armed:
+            self.latched[:] = bytes(self.registers())
+        self._latch_armed = val == 0
+
+    def write(self, reg, val):
+        regs = self.registers()
+        regs[reg - 0x08] = val
+        self._set(regs)
+        self.latched[reg - 0x08] = val
+
+    def _set(self, regs):
+        s, m, h, dl, dh = regs
+        self.secs = s + 60 * m + 3600 * h + 86400 * (dl | (dh & 0x01) << 8)
+        self.cycles = self.clock()
+        self.halted = bool(dh & 0x40)
+        self.carry = bool(dh & 0x80)
+
+    def dump(self) -> bytes:
+        return struct.pack(RTC_FORMAT, *self.registers(), *self.latched, int(time.time()))
+
+    def load(self, data: bytes):
+        """
+        Pick up from a saved clock, counting the time since it was saved
+        """
+        fields = struct.unpack(RTC_FORMAT, data)
+        self._set([val & 0xFF for val in fields[0:5]])
+        self.latched[:] = bytes(val & 0xFF for val in fields[5:10])
+        if not self.halted:
+            self.secs += max(0, int(time.time()) - fields[10])
+
+
+class RTCRegister:
+    """
+    What's at 0xA000-0xBFFF while one of the clock's registers is
+    selected: every address is that register
+    """
+    __slots__ = ("rtc", "reg")
+
+    def __init__(self, rtc, reg):
+        self.rtc = rtc
+        self.reg = reg
+
+    def __getitem__(self, off):
+        return self.rtc.latched[self.reg - 0x08]
+
+    def __setitem__(self, off, val):
+        self.rtc.write(self.reg, val)
+
+
+class SaveFile:
+    """
+    A battery-backed cart's RAM (and clock, if it has one) kept in a
+    memory-mapped .sav file.
+
+    The RAM itself stays in memory; flush() copies the 256-byte pages
+    which differ from the file's into the mapping, and the OS writes
+    them out in the background, so flushing never waits for the disk.
+    close() does wait, for the last flush before exiting.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "game.sav")
+    >>> ram = bytearray(0x2000)
+    >>> save = SaveFile(path, ram)
+    >>> ram[0x0105] = 0x42
+    >>> ram[0x1FFF] = 0x43
+    >>> save.flush()
+    2
+    >>> save.flush()
+    0
+    >>> save.close()
+    >>> ram = bytearray(0x2000)
+    >>> _ = SaveFile(path, ram)
+    >>> ram[0x0105], ram[0x1FFF]
+    (66, 67)
+    """
+    def __init__(self, path: str, ram: bytearray, rtc: RTC = None):
+        self.path = path
+        self.ram = ram
+        self.rtc = rtc
+        size = len(ram) + (RTC_BYTES if rtc else 0)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        saved = os.fstat(self._fd).st_size
+        if saved < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        ram[:] = self._map[:len(ram)]
+        if rtc and saved >= size:
+            rtc.load(self._map[len(ram):size])
+
+    def flush(self) -> int:
+        """
+        Copy the pages which have changed since the last flush to the
+        file, returning how many there were
+        """
+        ram = memoryview(self.ram)
+        disk = self._map
+        dirty = 0
+        for start in range(0, len(ram), 0x100):
+            end = start + 0x100
+            if ram[start:end] != disk[start:end]:
+                disk[start:end] = ram[start:end]
+                dirty += 1
+        if self.rtc:
+            disk[len(ram):] = self.rtc.dump()
+        return dirty
+
+    def close(self):
+        self.flush()
+        self._map.flush()
+        self._map.close()
+        os.close(self._fd)
+
+
+class MBC:
+    """
+    The cart's memory bank controller: which 16KB banks of ROM appear at
+    0x0000-0x3FFF and 0x4000-0x7FFF, and which 8KB bank of cart RAM (if
+    any) at 0xA000-0xBFFF.
+
+    Banks are mapped by pointing the MMU's pages at memoryviews of
+    `cart.data` and `ram`, so a bank switch costs 64 list entries rather
+    than a 16KB copy. The page lists for every bank are built up front.
+
+    This base class is for carts with no controller: 32KB of ROM, and
+    maybe 8KB of RAM, which never move.
+
+    >>> data = bytearray(0x8000)
+    >>> data[0x4000] = 0x42
+    >>> mmu = MMU(bytearray(0x10000))
+    >>> mbc = MBC(Cart.__new__(Cart), mmu, data=data, ram_bytes=0)
+    >>> hex(mmu.read(0x4000)), mbc.banks
+    ('0x42', [0, 65536])
+    """
+    # Whether cart RAM is switched on; only controllers can switch it off
+    ram_enabled = True
+    rtc = None
+
+    def __init__(self, cart: Cart, mmu: MMU, data=None, ram_bytes=None):
+        if data is None:
+            data = cart.data
+        if ram_bytes is None:
+            ram_bytes = cart.ram_bytes
+        # short ROMs (like test ROMs) get padded out to a whole number of
+        # banks, with at least two of them
+        if len(data) < 0x8000 or len(data) % 0x4000:
+            data = bytes(data) + b"\xFF" * (max(0x8000, -(-len(data) // 0x4000) * 0x4000) - len(data))
+        self.cart = cart
+        self.mmu = mmu
+        self.rom = memoryview(data)
+        self.rom_banks = len(data) // 0x4000
+        self.ram = bytearray(ram_bytes)
+        self.ram_banks = max(1, ram_bytes // 0x2000)
+
+        rom, ram = self.rom, memoryview(self.ram)
+        self._rom_pages = [
+            [rom[(b << 14) + (p << 8):(b << 14) + ((p + 1) << 8)] for p in range(0x40)]
+            for b in range(self.rom_banks)
+        ]
+        # 2KB of RAM only fills the start of its bank
+        self._ram_pages = [
+            [
+                ram[(b << 13) + (p << 8):(b << 13) + ((p + 1) << 8)] if (b << 13) + (p << 8) < ram_bytes else UNMAPPED
+                for p in range(0x20)
+            ]
+            for b in range(self.ram_banks)
+        ] if ram_bytes else []
+
+        # Where RAM gets saved, for carts with a battery
+        self.save = None
+
+        # Called with no arguments after 0xA000-0xBFFF changes, for
+        # anything which cares what's there (like the JIT)
+        self.on_ram_map = None
+
+        # The ROM bank at 0x0000 and 0x4000, pre-shifted for bank_of()
+        self.banks = [0, 1 << 16]
+
+        for p in range(0x00, 0x80):
+            mmu.wr[p] = WriteHook(p << 8, self.write)
+        self.map_rom(0, 1)
+        self.map_ram(self.ram_enabled, 0)
+
+    def write(self, addr, val):
+        pass
+
+    def open_save(self, path: str):
+        """
+        Load RAM from the .sav file at `path` (creating it if need be),
+        which flush() will then keep up to date
+        """
+        if self.ram or self.rtc:
+            self.save = SaveFile(path, self.ram, self.rtc)
+
+    def flush(self):
+        if self.save:
+            self.save.flush()
+
+    def close(self):
+        if self.save:
+            self.save.close()
+            self.save = None
+
+    def map_rom(self, low, high):
+        """
+        Put ROM bank `low` at 0x0000 and `high` at 0x4000
+        """
+        low %= self.rom_banks
+        high %= self.rom_banks
+        self.banks[0] = low << 16
+        self.banks[1] = high << 16
+        self.mmu.rd[0x00:0x40] = self._rom_pages[low]
+        self.mmu.rd[0x40:0x80] = self._rom_pages[high]
+        if self.mmu.boot is not None:
+            self.mmu.rd[0x00] = self.mmu.boot
+
+    def remap(self):
+        """
+        Map the current ROM banks again, eg after the boot ROM's gone
+        """
+        self.map_rom(self.banks[0] >> 16, self.banks[1] >> 16)
+
+    def map_ram(self, enabled, bank):
+        """
+        Put RAM bank `bank` at 0xA000, or nothing if RAM is disabled
+        """
+        if enabled and self._ram_pages:
+            self.map_ram_pages(self._ram_pages[bank % self.ram_banks])
+        else:
+            self.map_ram_pages([UNMAPPED] * 0x20)
+
+    def map_ram_pages(self, pages):
+        self.mmu.rd[0xA0:0xC0] = pages
+        self.mmu.wr[0xA0:0xC0] = pages
+        if self.on_ram_map:
+            self.on_ram_map()
+
+    def bank_of(self, addr):
+        """
+        Which ROM bank `addr` currently reads from, or 0 outside of ROM
+        """
+        if addr < 0x8000:
+            return self.banks[addr >> 14] >> 16
+        return 0
+
+
+class MBC1(MBC):
+    """
+    Up to 2MB of ROM and 32KB of RAM. 0x2000 picks the low 5 bits of the
+    ROM bank (0 meaning 1), 0x4000 two more bits which go to either the
+    ROM bank or the RAM bank depending on the mode set at 0x6000.
+
+    >>> data = bytearray(0x40000)
+    >>> for b in range(16): data[b * 0x4000] = b
+    >>> mmu = MMU(bytearray(0x10000))
+    >>> mbc = MBC1(Cart.__new__(Cart), mmu, data=data, ram_bytes=0)
+    >>> mmu.write(0x2000, 5)
+    >>> mmu.read(0x4000), mbc.bank_of(0x4000)
+    (5, 5)
+    >>> mmu.write(0x2000, 0)
+    >>> mmu.read(0x4000)
+    1
+    """
+    ram_enabled = False
+
+    def __init__(self, cart: Cart, mmu: MMU, **kwargs):
+        self.low = 1
+        self.high = 0
+        self.mode = 0
+        super().__init__(cart, mmu, **kwargs)
+
+    def write(self, addr, val):
+        if addr < 0x2000:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+            self._map_ram()
+        elif addr < 0x4000:
+            self.low = (val & 0x1F) or 1
+            self._map_rom()
+        elif addr < 0x6000:
+            self.high = val & 0x03
+            self._map_rom()
+            self._map_ram()
+        else:
+            self.mode = val & 0x01
+            self._map_rom()
+            self._map_ram()
+
+    def _map_rom(self):
+        low = (self.high << 5) if self.mode else 0
+        self.map_rom(low, (self.high << 5) | self.low)
+
+    def _map_ram(self):
+        self.map_ram(self.ram_enabled, self.high if self.mode else 0)
+
+
+class MBC3(MBC):
+    """
+    Up to 2MB of ROM and 32KB of RAM, with a 7-bit ROM bank number (0
+    meaning 1) at 0x2000 and the RAM bank at 0x4000. RAM banks 08-0C
+    are the clock's registers, if the cart has one, which get latched
+    by writing 0 then 1 to 0x6000.
+
+    >>> data = bytearray(0x40000)
+    >>> for b in range(16): data[b * 0x4000] = b
+    >>> mmu = MMU(bytearray(0x10000))
+    >>> mbc = MBC3(Cart.__new__(Cart), mmu, data=data, ram_bytes=0x8000)
+    >>> mmu.write(0x2000, 9)
+    >>> mmu.write(0x0000, 0x0A)
+    >>> mmu.write(0x4000, 2)
+    >>> mmu.write(0xA000, 0x42)
+    >>> mmu.read(0x4000), mbc.ram[0x4000]
+    (9, 66)
+    """
+    ram_enabled = False
+
+    def __init__(self, cart: Cart, mmu: MMU, rtc: RTC = None, **kwargs):
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.rtc = rtc
+        super().__init__(cart, mmu, **kwargs)
+
+    def write(self, addr, val):
+        if addr < 0x2000:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+            self._map_ram()
+        elif addr < 0x4000:
+            self.rom_bank = (val & 0x7F) or 1
+            self.map_rom(0, self.rom_bank)
+        elif addr < 0x6000:
+            self.ram_bank = val
+            self._map_ram()
+        elif self.rtc:
+            self.rtc.latch(val)
+
+    def _map_ram(self):
+        if self.ram_bank < 0x04:
+            self.map_ram(self.ram_enabled, self.ram_bank)
+        elif 0x08 <= self.ram_bank <= 0x0C and self.rtc and self.ram_enabled:
+            self.map_ram_pages([RTCRegister(self.rtc, self.ram_bank)] * 0x20)
+        else:
+            self.map_ram(False, 0)
+
+
+class MBC5(MBC):
+    """
+    Up to 8MB of ROM and 128KB of RAM, with a 9-bit ROM bank number
+    split over 0x2000 (low 8) and 0x3000 (bit 8); bank 0 really is bank
+    0 here.
+
+    >>> data = bytearray(0x40000)
+    >>> for b in range(16): data[b * 0x4000] = b
+    >>> mmu = MMU(bytearray(0x10000))
+    >>> mbc = MBC5(Cart.__new__(Cart), mmu, data=data, ram_bytes=0)
+    >>> mmu.write(0x2000, 0)
+    >>> mmu.read(0x4000)
+    0
+    """
+    ram_enabled = False
+
+    def __init__(self, cart: Cart, mmu: MMU, **kwargs):
+        self.rom_bank = 1
+        self.ram_bank = 0
+        super().__init__(cart, mmu, **kwargs)
+
+    def write(self, addr, val):
+        if addr < 0x2000:
+            self.ram_enabled = (val & 0x0F) == 0x0A
+            self.map_ram(self.ram_enabled, self.ram_bank)
+        elif addr < 0x3000:
+            self.rom_bank = (self.rom_bank & 0x100) | val
+            self.map_rom(0, self.rom_bank)
+        elif addr < 0x4000:
+            self.rom_bank = (self.rom_bank & 0xFF) | (val & 0x01) << 8
+            self.map_rom(0, self.rom_bank)
+        elif addr < 0x6000:
+            self.ram_bank = val & 0x0F
+            self.map_ram(self.ram_enabled, self.ram_bank)
+
+
+MBCS = {
+    CartType.ROM_MBC1: MBC1,
+    CartType.ROM_MBC1_RAM: MBC1,
+    CartType.ROM_MBC1_RAM_BATT: MBC1,
+    CartType.ROM_MBC3_TIMER_BATT: MBC3,
+    CartType.ROM_MBC3_TIMER_RAM_BATT: MBC3,
+    CartType.ROM_MBC3: MBC3,
+    CartType.ROM_MBC3_RAM: MBC3,
+    CartType.ROM_MBC3_RAM_BATT: MBC3,
+    CartType.ROM_MBC5: MBC5,
+    CartType.ROM_MBC5_RAM: MBC5,
+    CartType.ROM_MBC5_RAM_BATT: MBC5,
+    CartType.ROM_MBC5_RUMBLE: MBC5,
+    CartType.ROM_MBC5_RUMBLE_RAM: MBC5,
+    CartType.ROM_MBC5_RUMBLE_RAM_BATT: MBC5,
+}
+
+
+def for_cart(cart: Cart, mmu: MMU, clock=None) -> MBC:
+    """
+    The right bank controller for `cart`, mapped into `mmu`; controllers
+    which aren't emulated get the plain 32KB mapping. Carts with a clock
+    get one which reads the time in cycles from `clock()`.
+    """
+    cls = MBCS.get(cart.cart_type, MBC)
+    if cls is MBC3 and "TIMER" in cart.cart_type.name:
+        return cls(cart, mmu, rtc=RTC(clock))
+    return cls(cart, mmu)
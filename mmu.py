@@ -0,0 +1,266 @@
+class IOPage:
+    """
+    The 0xFF00-0xFFFF page: hardware registers, HRAM and IE. Registers
+    with side effects get hooks in `on_read` (called with no arguments,
+    returning the value) and `on_write` (called with the value, instead
+    of storing it); everything else is plain memory.
+
+    >>> io = IOPage(bytearray(0x100))
+    >>> io.on_write[0x01] = lambda val: print("SB = %02X" % val)
+    >>> io.on_read[0x44] = lambda: 0x90
+    >>> io[0x01] = 0x41
+    SB = 41
+    >>> io[0x80] = 0x42
+    >>> io[0x80], io[0x44]
+    (66, 144)
+    """
+    __slots__ = ("mem", "on_read", "on_write")
+
+    def __init__(self, mem):
+        self.mem = mem
+        self.on_read = [None] * 0x100
+        self.on_write = [None] * 0x100
+
+    def __getitem__(self, off):
+        hook = self.on_read[off]
+        if hook:
+            return hook()
+        return self.mem[off]
+
+    def __setitem__(self, off, val):
+        hook = self.on_write[off]
+        if hook:
+            hook(val)
+        else:
+            self.mem[off] = val
+
+
+class Unmapped:
+    """
+    A page with nothing behind it, like cart RAM which isn't there or
+    hasn't been enabled: reads give 0xFF and writes go nowhere
+    """
+    __slots__ = ()
+
+    def __getitem__(self, off):
+        return 0xFF
+
+    def __setitem__(self, off, val):
+        pass
+
+
+UNMAPPED = Unmapped()
+# What the CPU sees while it's locked out of the bus; it behaves the same
+# as UNMAPPED, but is a different object, so that unlock() can tell the
+# pages it put there from pages which really are unmapped
+LOCKED = Unmapped()
+
+
+class OAMPage:
+    """
+    The 0xFE00-0xFEFF page: sprite attributes up to 0xFE9F, then 96
+    bytes which aren't connected to anything; those read as 0x00 and
+    ignore writes
+
+    >>> oam = OAMPage(bytearray(0x100))
+    >>> oam[0x9F] = 0x42
+    >>> oam[0xA0] = 0x43
+    >>> oam[0x9F], oam[0xA0], oam.mem[0xA0]
+    (66, 0, 0)
+    """
+    __slots__ = ("mem",)
+
+    def __init__(self, mem):
+        self.mem = mem
+
+    def __getitem__(self, off):
+        if off < 0xA0:
+            return self.mem[off]
+        return 0x00
+
+    def __setitem__(self, off, val):
+        if off < 0xA0:
+            self.mem[off] = val
+
+
+class WriteHook:
+    """
+    A page whose writes go to `fn(addr, val)` instead of memory, for
+    ROM, where writes are how the cart's bank controller gets told what
+    to do
+    """
+    __slots__ = ("base", "fn")
+
+    def __init__(self, base, fn):
+        self.base = base
+        self.fn = fn
+
+    def __setitem__(self, off, val):
+        self.fn(self.base | off, val)
+
+
+class WatchedPage:
+    """
+    A page of memory which tells each of `fns(addr)` about every write
+    to it, just before it happens; the JIT uses this for pages holding
+    translated code, so that the blocks can be thrown away when the
+    code changes, and the PPU for VRAM, so that it can draw what's due
+    with the old contents and know which tiles have changed
+    """
+    __slots__ = ("base", "mem", "fns")
+
+    def __init__(self, base, mem, fns):
+        self.base = base
+        self.mem = mem
+        self.fns = fns
+
+    def __setitem__(self, off, val):
+        for fn in self.fns:
+            fn(self.base | off)
+        self.mem[off] = val
+
+
+class MMU:
+    """
+    The CPU's view of the 64KB address space, as 256 pages of 256 bytes.
+
+    `rd[page]` and `wr[page]` are what reads and writes of that page go
+    to, indexed by the offset within the page. For plain RAM and ROM
+    that's a memoryview of `ram`, so an access is just two indexes; the
+    pages where accesses have side effects get an object with
+    __getitem__ / __setitem__ instead. The lists themselves never get
+    replaced, only their entries, so the CPU can keep hold of them.
+
+    `ram` backs everything that isn't mapped in from somewhere else,
+    like the cart's ROM and RAM, which the MBC points pages at. Echo RAM
+    (0xE000-0xFDFF) is the same memoryviews as 0xC000-0xDDFF.
+
+    >>> mmu = MMU(bytearray(0x10000))
+    >>> mmu.write(0x1234, 0x42)  # ROM
+    >>> mmu.write(0xC000, 0x43)
+    >>> hex(mmu.read(0x1234)), hex(mmu.read(0xC000))
+    ('0x0', '0x43')
+    >>> show = lambda addr: print("%04X" % addr)
+    >>> mmu.watch(0xC0, show)
+    >>> mmu.write(0xC010, 1)
+    C010
+    >>> mmu.watch(0xC0, print)
+    >>> mmu.write(0xE010, 2)  # echo RAM
+    C010
+    49168
+    >>> mmu.unwatch(0xC0, show); mmu.unwatch(0xC0, print)
+    >>> mmu.write(0xC010, 3)
+    >>> mmu.read(0xE010), mmu.read(0xFEA0)
+    (3, 0)
+    """
+    def __init__(self, ram: bytearray):
+        self.ram = ram
+        view = memoryview(ram)
+        self.pages = [view[p << 8:(p + 1) << 8] for p in range(0x100)]
+        self.rd = list(self.pages)
+        self.wr = list(self.pages)
+
+        # ROM is read-only
+        for p in range(0x00, 0x80):
+            self.wr[p] = WriteHook(p << 8, self.rom_write)
+
+        # Echo RAM, and OAM plus the unusable bit after it
+        self.echo = {}
+        for p in range(0xE0, 0xFE):
+            self.rd[p] = self.wr[p] = self.pages[p - 0x20]
+            self.echo[p - 0x20] = p
+        self.oam = OAMPage(self.pages[0xFE])
+        self.rd[0xFE] = self.wr[0xFE] = self.oam
+
+        # The boot ROM's page, which the MBC lays over 0x0000-0x00FF
+        # until it gets unmapped
+        self.boot = None
+
+        self.io = IOPage(self.pages[0xFF])
+        self.rd[0xFF] = self.io
+        self.wr[0xFF] = self.io
+
+        # What rd and wr held before lock(), while the CPU is locked out
+        self.locked = None
+
+    def rom_write(self, addr, val):
+        pass
+
+    def read(self, addr):
+        return self.rd[addr >> 8][addr & 0xFF]
+
+    def write(self, addr, val):
+        self.wr[addr >> 8][addr & 0xFF] = val
+
+    def read_range(self, start, end):
+        page = self.rd[start >> 8]
+        if start >> 8 == (end - 1) >> 8 and isinstance(page, memoryview):
+            return bytes(page[start & 0xFF:((end - 1) & 0xFF) + 1])
+        return bytes(self.read(addr) for addr in range(start, end))
+
+    def snapshot(self):
+        """
+        The whole address space as the CPU currently sees it
+        """
+        out = bytearray()
+        for page in self.rd:
+            if isinstance(page, memoryview):
+                out += page
+            else:
+                out += bytes(page[off] for off in range(0x100))
+        return bytes(out)
+
+    def lock(self):
+        """
+        Cut the CPU off from everything but 0xFF00-0xFFFF (I/O and HRAM),
+        as during OAM DMA: reads give 0xFF and writes go nowhere, until
+        unlock(). Pages which get mapped to something else in between
+        (like ROM banks when the boot ROM goes) keep their new mapping.
+
+        >>> mmu = MMU(bytearray(0x10000))
+        >>> mmu.write(0xC000, 0x42)
+        >>> mmu.write(0xFF80, 0x43)
+        >>> mmu.lock()
+        >>> mmu.write(0xC000, 0x44)
+        >>> mmu.read(0xC000), mmu.read(0xFF80)
+        (255, 67)
+        >>> mmu.unlock()
+        >>> mmu.read(0xC000)
+        66
+        """
+        if self.locked is None:
+            self.locked = (self.rd[:0xFF], self.wr[:0xFF])
+            self.rd[:0xFF] = [LOCKED] * 0xFF
+            self.wr[:0xFF] = [LOCKED] * 0xFF
+
+    def unlock(self):
+        if self.locked is not None:
+            rd, wr = self.locked
+            self.locked = None
+            for p in range(0xFF):
+                if self.rd[p] is LOCKED:
+                    self.rd[p] = rd[p]
+                if self.wr[p] is LOCKED:
+                    self.wr[p] = wr[p]
+
+    def watch(self, page, fn):
+        """
+        Have `fn(addr)` told about writes to `page`, if it's plain memory,
+        including writes through its echo
+        """
+        for p in (page, self.echo.get(page)):
+            if p is None:
+                continue
+            if isinstance(self.wr[p], memoryview):
+                self.wr[p] = WatchedPage(page << 8, self.wr[p], [fn])
+            elif isinstance(self.wr[p], WatchedPage) and fn not in self.wr[p].fns:
+                self.wr[p].fns.append(fn)
+
+    def unwatch(self, page, fn):
+        for p in (page, self.echo.get(page)):
+            if p is not None and isinstance(self.wr[p], WatchedPage):
+                fns = self.wr[p].fns
+                if fn in fns:
+                    fns.remove(fn)
+                if not fns:
+                    self.wr[p] = self.wr[p].mem
@@ -0,0 +1,585 @@
+import sys
+from array import array
+from events import Scheduler
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+VRAM_BASE = 0x8000
+TILE_DATA_TABLE_0 = 0x8800
+TILE_DATA_TABLE_1 = 0x8000
+BACKGROUND_MAP_0 = 0x9800
+BACKGROUND_MAP_1 = 0x9C00
+WINDOW_MAP_0 = 0x9800
+WINDOW_MAP_1 = 0x9C00
+OAM_BASE = 0xFE00
+TILES = 384
+
+WIDTH = 160
+HEIGHT = 144
+
+# Each line is 80 cycles of OAM search (mode 2), 172 of drawing (mode
+# 3) and the rest HBlank (mode 0); after 144 of those come 10 lines of
+# VBlank (mode 1)
+CYCLES_PER_LINE = 456
+LINES_PER_FRAME = 154
+CYCLES_PER_FRAME = CYCLES_PER_LINE * LINES_PER_FRAME
+OAM_CYCLES = 80
+DRAW_CYCLES = 172
+VBLANK_START = HEIGHT * CYCLES_PER_LINE
+
+# LCDC bits
+LCDC_ENABLED        = 0b10000000
+LCDC_WINDOW_MAP     = 0b01000000
+LCDC_WINDOW_ENABLED = 0b00100000
+LCDC_DATA_SRC       = 0b00010000
+LCDC_BG_MAP         = 0b00001000
+LCDC_OBJ_SIZE       = 0b00000100
+LCDC_OBJ_ENABLED    = 0b00000010
+LCDC_BG_WIN_ENABLED = 0b00000001
+
+# STAT bits, other than the mode
+STAT_LYC_INT   = 0b01000000
+STAT_OAM_INT   = 0b00100000
+STAT_VBLANK_INT = 0b00010000
+STAT_HBLANK_INT = 0b00001000
+STAT_LYC_MATCH = 0b00000100
+
+# Registers which change what gets drawn, so lines due before a write
+# to one of them get drawn first: SCY, SCX, BGP, OBP0, OBP1, WY, WX
+RENDER_REGS = (0x42, 0x43, 0x47, 0x48, 0x49, 0x4A, 0x4B)
+
+# Runs of fewer lines than this get drawn by draw_line() even with
+# NumPy, as compose() costs about as much as that many draw_line()s
+# however few lines it does
+COMPOSE_MIN_LINES = 4
+
+
+# <editor-fold description="Tiles">
+def _tile_rows():
+    # Each bit of a byte spread out to the bottom bit of its own byte,
+    # so that a row's low and high bitplanes combine with one shift + or;
+    # that's done as one big integer per high byte, covering every low one
+    spread = [bytes((b >> (7 - x)) & 1 for x in range(8)) for b in range(0x100)]
+    low = int.from_bytes(b"".join(spread), "big")
+    return b"".join([
+        (low | int.from_bytes(bytes(bit << 1 for bit in spread[high]) * 0x100, "big")).to_bytes(0x800, "big")
+        for high in range(0x100)
+    ])
+
+
+# The 8 palette indices of a row of tile pixels, at 8 * the row's two
+# bytes as a little-endian uint16, ie (high << 8 | low); one 512KB table
+# rather than 64K little ones
+TILE_ROWS = _tile_rows()
+
+# Palette register value -> bytes.translate() table from colour index
+# to shade
+PALETTES = [
+    bytes(val >> (2 * (n & 3)) & 3 for n in range(0x100))
+    for val in range(0x100)
+]
+
+
+def decode_tiles(data) -> bytes:
+    """
+    Any number of 16-byte 2bpp tiles to 64 palette indices per tile,
+    one byte per pixel
+
+    >>> list(decode_tiles(bytes([0x3C, 0x7E] + [0x00] * 14))[:8])
+    [0, 2, 3, 3, 3, 3, 2, 0]
+    """
+    rows = array("H", bytes(data))
+    if sys.byteorder == "big":
+        rows.byteswap()
+    table = TILE_ROWS
+    return b"".join([table[row * 8:row * 8 + 8] for row in rows])
+# </editor-fold>
+
+
+# <editor-fold description="Drawing">
+def _map_row(ram, pixels, base, lcdc, row):
+    # One row of pixels across the whole 32-tile map at `base`, as
+    # colour indices
+    ids = ram[base + (row >> 3) * 32:base + (row >> 3) * 32 + 32]
+    fine = (row & 7) * 8
+    if lcdc & LCDC_DATA_SRC:
+        starts = [t * 64 + fine for t in ids]
+    else:
+        # tiles 0-127 come from 0x9000, 128-255 from 0x8800
+        starts = [(t if t & 0x80 else t | 0x100) * 64 + fine for t in ids]
+    return b"".join([pixels[start:start + 8] for start in starts])
+
+
+def draw_line(ram, pixels, y) -> bytearray:
+    """
+    Line `y` of the screen as 160 shades (0 = white, 3 = black), from
+    the registers, maps and OAM in `ram` and `pixels` (the 384 tiles at
+    0x8000 as decode_tiles() gives them)
+
+    >>> ram = bytearray(0x10000)
+    >>> ram[0xFF40] = LCDC_ENABLED | LCDC_DATA_SRC | LCDC_BG_WIN_ENABLED
+    >>> ram[0xFF47] = 0xE4  # shade n for colour n
+    >>> ram[0x9800] = 1
+    >>> pixels = bytes(64) + bytes([3] * 64) + bytes(382 * 64)
+    >>> list(draw_line(ram, pixels, 0)[6:10])
+    [3, 3, 0, 0]
+    """
+    lcdc = ram[0xFF40]
+    colours = bytes(WIDTH)
+    if lcdc & LCDC_BG_WIN_ENABLED:
+        scx = ram[0xFF43]
+        bg = _map_row(ram, pixels, BACKGROUND_MAP_1 if lcdc & LCDC_BG_MAP else BACKGROUND_MAP_0, lcdc,
+                      (y + ram[0xFF42]) & 0xFF)
+        colours = (bg[scx:] + bg[:scx])[:WIDTH]
+
+        wy, wx = ram[0xFF4A], ram[0xFF4B] - 7
+        if lcdc & LCDC_WINDOW_ENABLED and wy <= y and wx < WIDTH:
+            win = _map_row(ram, pixels, WINDOW_MAP_1 if lcdc & LCDC_WINDOW_MAP else WINDOW_MAP_0, lcdc, y - wy)
+            left = max(wx, 0)
+            colours = colours[:left] + win[left - wx:WIDTH - wx]
+    shades = bytearray(colours.translate(PALETTES[ram[0xFF47]]))
+
+    if lcdc & LCDC_OBJ_ENABLED:
+        height = 16 if lcdc & LCDC_OBJ_SIZE else 8
+        sprites = []
+        for n in range(OAM_BASE, OAM_BASE + 0xA0, 4):
+            top = ram[n] - 16
+            if top <= y < top + height:
+                sprites.append((ram[n + 1], n))
+        # lower x (then lower OAM index) wins, and each pixel belongs to
+        # the first sprite with colour there even if that sprite is
+        # behind the background
+        sprites.sort()
+        taken = bytearray(WIDTH)
+        for x, n in sprites:
+            x -= 8
+            tile_id, flags = ram[n + 2], ram[n + 3]
+            row = y - (ram[n] - 16)
+            if flags & 0x40:
+                row = height - 1 - row
+            if height == 16:
+                tile_id = (tile_id & 0xFE) | row >> 3
+            start = tile_id * 64 + (row & 7) * 8
+            sprite = pixels[start:start + 8]
+            if flags & 0x20:
+                sprite = sprite[::-1]
+            palette = PALETTES[ram[0xFF49 if flags & 0x10 else 0xFF48]]
+            behind = flags & 0x80
+            for i in range(8):
+                colour = sprite[i]
+                if colour and 0 <= x + i < WIDTH and not taken[x + i]:
+                    taken[x + i] = 1
+                    if not (behind and colours[x + i]):
+                        shades[x + i] = palette[colour]
+    return shades
+
+
+def _map_pixels(tiles, ram, base, lcdc, ys, xs):
+    # Colour indices at rows `ys` and columns `xs` of the 256x256 picture
+    # which the 32x32 tile map at `base` makes, looking up only the tiles
+    # those land in, so that drawing a few lines costs a few lines
+    ids = np.frombuffer(ram, np.uint8, 0x400, base)[(ys >> 3)[:, None] * 32 + (xs >> 3)[None, :]].astype(np.intp)
+    if not lcdc & LCDC_DATA_SRC:
+        # tiles 0-127 come from 0x9000, 128-255 from 0x8800
+        ids = np.where(ids < 0x80, ids + 0x100, ids)
+    return tiles[ids, (ys & 7)[:, None], (xs & 7)[None, :]]
+
+
+def compose(ram, tiles, first=0, last=HEIGHT):
+    """
+    Lines `first` to `last` of the screen, all in one go with NumPy, as
+    an array of shades; `tiles` is the 384 tiles at 0x8000 as a
+    (384, 8, 8) array of colour indices. Gives the same as draw_line()
+    for each line.
+
+    >>> ram = bytearray(0x10000)
+    >>> ram[0xFF40] = LCDC_ENABLED | LCDC_DATA_SRC | LCDC_BG_WIN_ENABLED
+    >>> ram[0xFF47] = 0xE4  # shade n for colour n
+    >>> ram[0x9800] = 1
+    >>> tiles = np.zeros((384, 8, 8), np.uint8)
+    >>> tiles[1] = 3
+    >>> shades = compose(ram, tiles)
+    >>> shades.shape, int(shades[0:8, 0:8].min()), int(shades[0:8, 8:].max())
+    ((144, 160), 3, 0)
+    """
+    lcdc = ram[0xFF40]
+    lines = last - first
+    bgp = np.frombuffer(PALETTES[ram[0xFF47]], np.uint8, 4)
+
+    # Colour indices first, as sprites need to know where the
+    # background's colour 0 is
+    colours = np.zeros((lines, WIDTH), np.uint8)
+    if lcdc & LCDC_BG_WIN_ENABLED:
+        scy, scx = ram[0xFF42], ram[0xFF43]
+        ys = (np.arange(first, last) + scy) & 0xFF
+        xs = (np.arange(WIDTH) + scx) & 0xFF
+        colours[:] = _map_pixels(tiles, ram, BACKGROUND_MAP_1 if lcdc & LCDC_BG_MAP else BACKGROUND_MAP_0, lcdc, ys, xs)
+
+        wy, wx = ram[0xFF4A], ram[0xFF4B] - 7
+        if lcdc & LCDC_WINDOW_ENABLED and wy < last and wx < WIDTH:
+            top, left = max(wy, first), max(wx, 0)
+            ys = np.arange(top - wy, last - wy)
+            xs = np.arange(left - wx, WIDTH - wx)
+            colours[top - first:, left:] = _map_pixels(
+                tiles, ram, WINDOW_MAP_1 if lcdc & LCDC_WINDOW_MAP else WINDOW_MAP_0, lcdc, ys, xs)
+    shades = bgp[colours]
+
+    if lcdc & LCDC_OBJ_ENABLED:
+        height = 16 if lcdc & LCDC_OBJ_SIZE else 8
+        obp = [np.frombuffer(PALETTES[ram[reg]], np.uint8, 4) for reg in (0xFF48, 0xFF49)]
+        oam = ram[OAM_BASE:OAM_BASE + 0xA0]
+        # only the sprites on these lines, and on screen, get looked at
+        ys = np.frombuffer(oam, np.uint8)[0::4].astype(np.intp) - 16
+        xs = np.frombuffer(oam, np.uint8)[1::4].astype(np.intp) - 8
+        visible = np.flatnonzero((ys > first - height) & (ys < last) & (xs > -8) & (xs < WIDTH))
+        sprites = sorted(visible.tolist(), key=lambda n: (oam[n * 4 + 1], n))
+        taken = np.zeros((lines, WIDTH), bool)
+        for n in sprites:
+            y, x, tile_id, flags = oam[n * 4:n * 4 + 4]
+            y -= 16
+            x -= 8
+            if height == 16:
+                sprite = np.concatenate((tiles[tile_id & 0xFE], tiles[tile_id | 0x01]))
+            else:
+                sprite = tiles[tile_id]
+            if flags & 0x40:
+                sprite = sprite[::-1]
+            if flags & 0x20:
+                sprite = sprite[:, ::-1]
+            top, left = max(y, first), max(x, 0)
+            bottom, right = min(y + height, last), min(x + 8, WIDTH)
+            sprite = sprite[top - y:bottom - y, left - x:right - x]
+            area = (slice(top - first, bottom - first), slice(left, right))
+            opaque = sprite != 0
+            mask = opaque & ~taken[area]
+            taken[area] |= opaque
+            if flags & 0x80:
+                mask &= colours[area] == 0
+            shades[area][mask] = obp[flags >> 4 & 1][sprite[mask]]
+    return shades
+
+
+def pgm(frame) -> bytes:
+    """
+    A frame of shades as a binary PGM image, which needs nothing but
+    the standard library to write out and most things can open
+
+    >>> pgm(bytes([0, 3]) + bytes(WIDTH * HEIGHT - 2))[:16]
+    b'P5 160 144 3\\n\\x03\\x00\\x03'
+    """
+    # PGM's 0 is black
+    return b"P5 %d %d 3\n" % (WIDTH, HEIGHT) + bytes(frame).translate(PALETTES[0x1B])
+# </editor-fold>
+
+
+class PPU:
+    """
+    The LCD controller: LY (0xFF44), STAT (0xFF41), LYC (0xFF45), the
+    VBlank and STAT interrupts, and the picture.
+
+    Like the timer, nothing happens line by line as time passes. LY and
+    STAT's mode are worked out from the cycle count when they're read,
+    and the only things that get scheduled are VBlank and the next time
+    the STAT interrupt goes off, if any of its sources are enabled.
+
+    Lines get drawn into `back` lazily, in runs: before a write to a
+    register which changes the picture, whichever lines the real thing
+    would have finished by then are drawn with the old values, so that
+    mid-frame scrolling and palette changes land on the right lines. At
+    VBlank the rest get drawn and `back` becomes `frame`, the latest
+    finished picture: 160x144 shades, 0 (white) to 3 (black), a byte
+    each. None of this needs pygame, so headless runs get frames too;
+    lcd.LCD is what puts them in a window.
+
+    >>> from cart import Cart, rom_image
+    >>> from cpu import CPU, Interrupt
+    >>> rom = rom_image()
+    >>> rom[0x0150:0x0152] = [0x18, 0xFE]  # JR -2
+    >>> c = CPU(Cart(rom))
+    >>> c.mmu.write(0xFF50, 1)  # boot ROM off
+    >>> c.PC = 0x0150
+    >>> c.mmu.write(0xFF45, 2)
+    >>> c.mmu.write(0xFF41, STAT_LYC_INT)
+    >>> c.run(2 * CYCLES_PER_LINE + 8)
+    (924, <Exit.CYCLES: 'cycles'>)
+    >>> c.mmu.read(0xFF44), hex(c.mmu.read(0xFF41))
+    (2, '0xc6')
+    >>> bool(c.ram[0xFF0F] & Interrupt.STAT)
+    True
+    >>> c.run(VBLANK_START)
+    (65664, <Exit.CYCLES: 'cycles'>)
+    >>> c.ppu.frames, c.mmu.read(0xFF44), bool(c.ram[0xFF0F] & Interrupt.VBLANK)
+    (1, 146, True)
+    """
+    def __init__(self, cpu, vblank, stat):
+        self.now = cpu.now
+        self.cpu = cpu
+        self.vblank = vblank
+        self.stat = stat
+        self.sched: Scheduler = cpu.sched
+        self.ram = cpu.ram
+        self.io = cpu.mmu.io
+
+        self.frame = bytearray(WIDTH * HEIGHT)
+        self.back = bytearray(WIDTH * HEIGHT)
+        self.frames = 0
+        # lines of `back` drawn so far
+        self.drawn = 0
+        # when the VBlank at the end of the frame being drawn is due, or
+        # None while the LCD is off
+        self.vblank_due = None
+
+        # Every tile at 0x8000-0x97FF decoded to colour indices, the
+        # tiles which have been written to since, and how many times
+        # each one has been decoded (so that things like the debug view
+        # can tell which have changed); the palettes only get applied
+        # when lines are drawn, so this only changes with VRAM
+        self.pixels = bytearray(TILES * 64)
+        self.tiles = np.frombuffer(self.pixels, np.uint8).reshape(TILES, 8, 8) if np is not None else None
+        self.dirty = set(range(TILES))
+        self.versions = [0] * TILES
+
+        self.io.on_read[0x41] = self.read_stat
+        self.io.on_read[0x44] = self.read_ly
+        self.io.on_write[0x40] = self.write_lcdc
+        self.io.on_write[0x41] = self.write_stat
+        self.io.on_write[0x44] = self.write_ly
+        self.io.on_write[0x45] = self.write_lyc
+        for reg in RENDER_REGS:
+            self.io.on_write[reg] = self._render_write(reg)
+        for page in range(VRAM_BASE >> 8, 0xA0):
+            cpu.mmu.watch(page, self._vram_write)
+
+        if self.io.mem[0x40] & LCDC_ENABLED:
+            self._start(0)
+
+    # <editor-fold description="Timing">
+    def _start(self, when):
+        # the LCD's just been switched on, at the start of line 0
+        self.drawn = 0
+        self.vblank_due = when + VBLANK_START
+        self.sched.at(self.vblank_due, "vblank", self._vblank)
+        self._schedule_stat(when)
+
+    def _position(self, now):
+        # cycles into the frame at `now`
+        return (now - self.vblank_due + VBLANK_START) % CYCLES_PER_FRAME
+
+    def _mode(self, pos):
+        line, dot = divmod(pos, CYCLES_PER_LINE)
+        if line >= HEIGHT:
+            return 1
+        if dot < OAM_CYCLES:
+            return 2
+        if dot < OAM_CYCLES + DRAW_CYCLES:
+            return 3
+        return 0
+
+    def _stat_line(self, pos):
+        # whether any of the enabled STAT interrupt sources is on at
+        # `pos`; the interrupt goes off when this goes from off to on
+        stat = self.io.mem[0x41]
+        mode = self._mode(pos)
+        return bool(
+            stat & STAT_LYC_INT and pos // CYCLES_PER_LINE == self.io.mem[0x45]
+            or stat & STAT_HBLANK_INT and mode == 0
+            or stat & STAT_VBLANK_INT and mode == 1
+            or stat & STAT_OAM_INT and mode == 2
+        )
+
+    def _schedule_stat(self, now):
+        if self.vblank_due is None or not self.io.mem[0x41] & 0x78:
+            self.sched.cancel("stat")
+            return
+        # things only turn on at the start of a line or of HBlank, so
+        # look at those in order, for up to a frame
+        pos = self._position(now)
+        frame = now - pos
+        line = pos // CYCLES_PER_LINE
+        for n in range(line, line + LINES_PER_FRAME + 1):
+            for point in (n * CYCLES_PER_LINE, n * CYCLES_PER_LINE + OAM_CYCLES + DRAW_CYCLES):
+                if point <= pos:
+                    continue
+                at = point % CYCLES_PER_FRAME
+                if self._stat_line(at) and not self._stat_line((at - 1) % CYCLES_PER_FRAME):
+                    self.sched.at(frame + point, "stat", self._stat)
+                    self.cpu._deadline = 0
+                    return
+        self.sched.cancel("stat")
+
+    def next_change(self, now, stat=True):
+        """
+        When LY (and with `stat`, STAT's mode) will next read differently
+        from how it does at `now`, or None while the LCD is off and they
+        don't change at all
+
+        >>> from cpu import CPU
+        >>> c = CPU()
+        >>> c.ppu.next_change(100), c.ppu.next_change(100, stat=False)
+        (252, 456)
+        >>> c.ppu.next_change(VBLANK_START + 10)
+        66120
+        """
+        if self.vblank_due is None:
+            return None
+        pos = self._position(now)
+        dot = pos % CYCLES_PER_LINE
+        if stat and pos < VBLANK_START:
+            if dot < OAM_CYCLES:
+                return now - dot + OAM_CYCLES
+            if dot < OAM_CYCLES + DRAW_CYCLES:
+                return now - dot + OAM_CYCLES + DRAW_CYCLES
+        return now - dot + CYCLES_PER_LINE
+
+    def _stat(self, when):
+        self.stat()
+        self._schedule_stat(when)
+
+    def _vblank(self, when):
+        self.catch_up(when)
+        self.frame, self.back = self.back, self.frame
+        self.frames += 1
+        self.drawn = 0
+        self.vblank_due = when + CYCLES_PER_FRAME
+        self.sched.at(self.vblank_due, "vblank", self._vblank)
+        self.vblank()
+    # </editor-fold>
+
+    # <editor-fold description="Drawing">
+    def catch_up(self, now):
+        """
+        Draw the lines of the current frame which would be finished by
+        `now`, that haven't been yet
+        """
+        if self.vblank_due is None:
+            return
+        if now >= self.vblank_due:
+            done = HEIGHT
+        else:
+            since = now - (self.vblank_due - VBLANK_START)
+            if since < 0:
+                return
+            done = min(HEIGHT, (since + CYCLES_PER_LINE - OAM_CYCLES - DRAW_CYCLES) // CYCLES_PER_LINE)
+        if done > self.drawn:
+            self.draw(self.drawn, done)
+            self.drawn = done
+
+    def frame_array(self):
+        """
+        The latest frame as a (144, 160) NumPy array, or without NumPy
+        a memoryview of that shape, sharing memory with `frame`; after
+        the next VBlank that's the buffer which gets drawn into, so copy
+        it if it needs to last
+
+        >>> from cpu import CPU
+        >>> CPU().ppu.frame_array().shape
+        (144, 160)
+        """
+        if np is None:
+            return memoryview(self.frame).cast("B", (HEIGHT, WIDTH))
+        return np.frombuffer(self.frame, np.uint8).reshape(HEIGHT, WIDTH)
+
+    def tile_pixels(self):
+        """
+        `pixels`, with the tiles which have changed decoded again
+
+        >>> from cpu import CPU
+        >>> c = CPU()
+        >>> pixels = c.ppu.tile_pixels()
+        >>> c.mmu.write(0x8010, 0xFF)
+        >>> c.ppu.dirty
+        {1}
+        >>> list(c.ppu.tile_pixels()[64:72])
+        [1, 1, 1, 1, 1, 1, 1, 1]
+        >>> c.ppu.versions[:3]
+        [1, 2, 1]
+        """
+        if self.dirty:
+            ram = self.ram
+            pixels = self.pixels
+            versions = self.versions
+            for tile in self.dirty:
+                start = VRAM_BASE + tile * 16
+                pixels[tile * 64:tile * 64 + 64] = decode_tiles(ram[start:start + 16])
+                versions[tile] += 1
+            self.dirty.clear()
+        return self.pixels
+
+    def invalidate(self):
+        """
+        Decode all the tiles again, after VRAM's been changed without
+        going through the MMU
+        """
+        self.dirty.update(range(TILES))
+
+    def draw(self, first, last):
+        """
+        Draw lines `first` to `last` into `back`, as things stand
+        """
+        ram = self.ram
+        pixels = self.tile_pixels()
+        if self.tiles is not None and last - first >= COMPOSE_MIN_LINES:
+            out = np.frombuffer(self.back, np.uint8).reshape(HEIGHT, WIDTH)
+            out[first:last] = compose(ram, self.tiles, first, last)
+        else:
+            for y in range(first, last):
+                self.back[y * WIDTH:(y + 1) * WIDTH] = draw_line(ram, pixels, y)
+    # </editor-fold>
+
+    # <editor-fold description="Registers">
+    def read_ly(self):
+        if self.vblank_due is None:
+            return 0
+        return self._position(self.now()) // CYCLES_PER_LINE
+
+    def read_stat(self):
+        stat = 0x80 | self.io.mem[0x41]
+        if self.read_ly() == self.io.mem[0x45]:
+            stat |= STAT_LYC_MATCH
+        if self.vblank_due is None:
+            return stat
+        return stat | self._mode(self._position(self.now()))
+
+    def write_lcdc(self, val):
+        now = self.now()
+        self.catch_up(now)
+        was_on = self.io.mem[0x40] & LCDC_ENABLED
+        self.io.mem[0x40] = val
+        if was_on and not val & LCDC_ENABLED:
+            # a switched off LCD shows nothing
+            self.vblank_due = None
+            self.sched.cancel("vblank")
+            self.sched.cancel("stat")
+            self.frame[:] = bytes(WIDTH * HEIGHT)
+        elif val & LCDC_ENABLED and not was_on:
+            self._start(now)
+            self.cpu._deadline = 0
+
+    def write_stat(self, val):
+        # the bottom three bits are read-only
+        self.io.mem[0x41] = val & 0x78
+        self._schedule_stat(self.now())
+
+    def write_ly(self, val):
+        pass
+
+    def write_lyc(self, val):
+        self.io.mem[0x45] = val
+        self._schedule_stat(self.now())
+
+    def _vram_write(self, addr):
+        # the lines due so far get drawn with what's there now, and a
+        # tile which is about to change gets decoded again next time
+        self.catch_up(self.now())
+        if addr < BACKGROUND_MAP_0:
+            self.dirty.add((addr - VRAM_BASE) >> 4)
+
+    def _render_write(self, reg):
+        def write(val):
+            self.catch_up(self.now())
+            self.io.mem[reg] = val
+        return write
+    # </editor-fold>
@@ -0,0 +1,132 @@
+from array import array
+from callgraph import bank_of
+
+
+class Profile:
+    """
+    How many times each opcode (0x000-0x0FF plain, 0x100-0x1FF with the
+    0xCB prefix) and each guest PC was executed, and the cycles spent on
+    it, as counted by CPU(profile=True), plus the cycles spent halted.
+    PCs are told apart by bank as well as address, using `bank_of(addr)`
+    (usually the MBC's), and reported as `bank << 16 | pc`.
+
+    >>> p = Profile()
+    >>> p.add(0x0150, 0x3C, 4)
+    >>> p.add(0x0151, 0x118, 8)
+    >>> p.add(0x0150, 0x3C, 4)
+    >>> p.add(0x4000, 0x00, 4)
+    >>> p.top_ops()
+    [(60, 2, 8), (280, 1, 8), (0, 1, 4)]
+    >>> p.top_pcs()
+    [(336, 2, 8), (337, 1, 8), (81920, 1, 4)]
+    >>> p = Profile(bank_of=lambda addr: 5 if 0x4000 <= addr < 0x8000 else 0, rom_banks=8)
+    >>> p.add(0x4100, 0x00, 4)
+    >>> p.add(0xC000, 0x00, 4)
+    >>> ["%05X" % pc for pc, count, cycles in p.top_pcs()]
+    ['54100', '0C000']
+    """
+    def __init__(self, bank_of=bank_of, rom_banks=2):
+        self.bank_of = bank_of
+        self.op_count = array("Q", bytes(8 * 0x200))
+        self.op_cycles = array("Q", bytes(8 * 0x200))
+        # PCs in ROM are counted at their offset into the ROM, ie
+        # bank << 14 | (pc & 0x3FFF), and 0x8000-0xFFFF after all that
+        self._high = (rom_banks << 14) - 0x8000
+        self.pc_count = array("Q", bytes(8 * ((rom_banks << 14) + 0x8000)))
+        self.pc_cycles = array("Q", bytes(8 * ((rom_banks << 14) + 0x8000)))
+        self.halted = 0
+
+    def add(self, pc, ins, cycles):
+        self.op_count[ins] += 1
+        self.op_cycles[ins] += cycles
+        if pc < 0x8000:
+            pc = self.bank_of(pc) << 14 | (pc & 0x3FFF)
+        else:
+            pc += self._high
+        self.pc_count[pc] += 1
+        self.pc_cycles[pc] += cycles
+
+    @staticmethod
+    def _top(count, cycles, n):
+        hits = [(k, count[k], cycles[k]) for k in range(len(count)) if count[k]]
+        hits.sort(key=lambda hit: (-hit[2], hit[0]))
+        return hits[:n]
+
+    def top_ops(self, n=None):
+        """
+        [(opcode, count, cycles), ...], most cycles first
+        """
+        return self._top(self.op_count, self.op_cycles, n)
+
+    def top_pcs(self, n=None):
+        """
+        [(bank << 16 | pc, count, cycles), ...], most cycles first; bank
+        0 counts as being at 0x0000-0x3FFF and the rest at 0x4000-0x7FFF
+        """
+        return [(self._key(i), count, cycles) for i, count, cycles in self._top(self.pc_count, self.pc_cycles, n)]
+
+    def _key(self, i):
+        if i - self._high >= 0x8000:
+            return i - self._high
+        bank = i >> 14
+        return bank << 16 | (0x4000 if bank else 0x0000) | (i & 0x3FFF)
+
+    def report(self, cpu, n=20):
+        """
+        Top-n tables of opcodes and guest PCs, by cycles
+        """
+        total = sum(self.op_cycles) + self.halted or 1
+        lines = ["Opcodes by cycles:", "  op   name                   count       cycles      %"]
+        for ins, count, cycles in self.top_ops(n):
+            lines.append("  %-4s %-16s %11d %12d %5.1f%%" % (
+                _op_str(ins), cpu._op_fn[ins].name, count, cycles, cycles * 100 / total))
+        lines.append("  %-4s %-16s %11s %12d %5.1f%%" % (
+            "", "(halted)", "", self.halted, self.halted * 100 / total))
+        lines += ["", "Guest PCs by cycles:", "  pc      op                  count       cycles      %"]
+        for key, count, cycles in self.top_pcs(n):
+            lines.append("  %-7s %-16s %8d %12d %5.1f%%" % (
+                _pc_str(key), _name_at(cpu, key), count, cycles, cycles * 100 / total))
+        return "\n".join(lines)
+
+    def to_json(self, cpu):
+        """
+        Everything that was executed, as something json.dump() can take
+        """
+        return {
+            "cycles": sum(self.op_cycles),
+            "halted": self.halted,
+            "instructions": sum(self.op_count),
+            "opcodes": [
+                {"op": _op_str(ins), "name": cpu._op_fn[ins].name, "count": count, "cycles": cycles}
+                for ins, count, cycles in self.top_ops()
+            ],
+            "pcs": [
+                {"pc": _pc_str(key), "name": _name_at(cpu, key), "count": count, "cycles": cycles}
+                for key, count, cycles in self.top_pcs()
+            ],
+        }
+
+
+def _op_str(ins):
+    return "CB%02X" % (ins & 0xFF) if ins & 0x100 else "%02X" % ins
+
+
+def _pc_str(key):
+    return "%02X:%04X" % (key >> 16, key & 0xFFFF)
+
+
+def _name_at(cpu, key):
+    # ROM is read from the bank that ran, anything else is whatever's
+    # there now, which might not be what ran if it's been overwritten
+    bank, pc = key >> 16, key & 0xFFFF
+    if pc < 0x8000:
+        rom = cpu.mbc.rom
+        offset = bank << 14 | (pc & 0x3FFF)
+        ins = rom[offset]
+        if ins == 0xCB and offset + 1 < len(rom):
+            ins = 0x100 | rom[offset + 1]
+    else:
+        ins = cpu.mmu.read(pc)
+        if ins == 0xCB and pc < 0xFFFF:
+            ins = 0x100 | cpu.mmu.read(pc + 1)
+    return cpu._op_fn[ins].name
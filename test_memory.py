@@ -0,0 +1,67 @@
+from cart import Cart, rom_image
+from cpu import CPU
+from mmu import MMU
+
+# Offsets into echo RAM to try: the first and last byte of each page,
+# and one in the middle
+OFFSETS = [page << 8 | off for page in range(0x1E) for off in (0x00, 0x7F, 0xFF)]
+
+
+def test_echo_reads_work_ram():
+    mmu = MMU(bytearray(0x10000))
+    for n in OFFSETS:
+        mmu.write(0xC000 + n, n & 0xFF ^ 0x5A)
+    for n in OFFSETS:
+        assert mmu.read(0xE000 + n) == n & 0xFF ^ 0x5A, hex(0xE000 + n)
+
+
+def test_echo_writes_work_ram():
+    ram = bytearray(0x10000)
+    mmu = MMU(ram)
+    for n in OFFSETS:
+        mmu.write(0xE000 + n, n & 0xFF ^ 0xA5)
+    for n in OFFSETS:
+        assert mmu.read(0xC000 + n) == n & 0xFF ^ 0xA5, hex(0xC000 + n)
+        assert ram[0xC000 + n] == n & 0xFF ^ 0xA5, hex(0xC000 + n)
+    # the last aliased page, at both ends
+    mmu.write(0xFDFF, 0x42)
+    mmu.write(0xFD00, 0x43)
+    assert (mmu.read(0xDDFF), mmu.read(0xDD00)) == (0x42, 0x43)
+    # the echo's own backing storage never gets used
+    assert not any(ram[0xE000:0xFE00])
+
+
+def test_echo_stops_at_fdff():
+    mmu = MMU(bytearray(0x10000))
+    mmu.write(0xDE00, 0x42)
+    mmu.write(0xFE00, 0x43)
+    assert mmu.read(0xFE00) == 0x43
+    assert mmu.read(0xDE00) == 0x42
+
+
+def test_unusable_area_is_unconnected():
+    ram = bytearray(0x10000)
+    mmu = MMU(ram)
+    for addr in range(0xFE00, 0xFEA0):
+        mmu.write(addr, addr & 0xFF)
+    before = bytes(ram)
+    for addr in range(0xFEA0, 0xFF00):
+        mmu.write(addr, 0xFF)
+    assert [mmu.read(addr) for addr in range(0xFEA0, 0xFF00)] == [0x00] * 0x60
+    assert [mmu.read(addr) for addr in range(0xFE00, 0xFEA0)] == list(range(0xA0))
+    assert bytes(ram) == before
+
+
+def test_jit_block_invalidated_through_echo():
+    cpu = CPU(Cart(rom_image()), jit=True)
+    cpu.mmu.write(0xFF50, 1)  # boot ROM off
+    cpu.ram[0xC000:0xC004] = [0x3E, 0x01, 0x18, 0xFC]  # LD A,1; JR -4
+    cpu.PC = 0xC000
+    cpu.tick_block()
+    assert cpu.A == 1
+    assert 0xC000 in cpu._blocks
+
+    cpu.mmu.write(0xE001, 0x02)  # LD A,2, through the echo
+    assert 0xC000 not in cpu._blocks
+    cpu.tick_block()
+    assert cpu.A == 2
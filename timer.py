@@ -0,0 +1,114 @@
+from events import Scheduler
+
+# Cycles per TIMA tick, for each value of TAC's bottom two bits
+TIMA_PERIODS = (1024, 16, 64, 256)
+
+
+class Timer:
+    """
+    DIV (0xFF04), TIMA (0xFF05), TMA (0xFF06) and TAC (0xFF07).
+
+    Nothing counts as time passes: DIV and TIMA are worked out from the
+    CPU's cycle count when they're read, and the only thing that gets
+    scheduled is TIMA's next overflow, which reloads it from TMA and
+    calls `interrupt()`.
+
+    As on the hardware, both count off the same internal 16-bit counter
+    (DIV is its top 8 bits), so TIMA ticks line up with DIV and writing
+    to DIV resets the lot.
+
+    >>> from cpu import CPU, Interrupt
+    >>> c = CPU()
+    >>> c.mmu.write(0xFF07, 0x05)  # TIMA on, every 16 cycles
+    >>> c.mmu.write(0xFF05, 0xF0)
+    >>> c.mmu.write(0xFF06, 0xF0)
+    >>> c.run(1000)
+    (1000, <Exit.CYCLES: 'cycles'>)
+    >>> c.mmu.read(0xFF04), c.mmu.read(0xFF05)
+    (3, 254)
+    >>> bool(c.ram[0xFF0F] & Interrupt.TIMER)
+    True
+    """
+    def __init__(self, cpu, interrupt):
+        self.cpu = cpu
+        self.interrupt = interrupt
+        self.sched: Scheduler = cpu.sched
+        self.now = cpu.now
+        self.io = cpu.mmu.io
+        # the cycle the internal counter was last zero at
+        self.div_base = 0
+        # TIMA's value as of `tima_base`
+        self.tima = 0
+        self.tima_base = 0
+
+        self.io.on_read[0x04] = self.read_div
+        self.io.on_read[0x05] = self.read_tima
+        self.io.on_write[0x04] = self.write_div
+        self.io.on_write[0x05] = self.write_tima
+        self.io.on_write[0x06] = self.write_tma
+        self.io.on_write[0x07] = self.write_tac
+
+    @property
+    def tac(self):
+        return self.io.mem[0x07]
+
+    def _ticks(self, start, end):
+        # TIMA ticks between two cycle counts, at TAC's current rate
+        if not self.tac & 0x04:
+            return 0
+        period = TIMA_PERIODS[self.tac & 0x03]
+        return (end - self.div_base) // period - (start - self.div_base) // period
+
+    def _rebase(self):
+        # bring TIMA up to date, so that the settings can change
+        now = self.now()
+        self.tima = self.read_tima()
+        self.tima_base = now
+
+    def _schedule(self):
+        if not self.tac & 0x04:
+            self.sched.cancel("timer")
+            return
+        period = TIMA_PERIODS[self.tac & 0x03]
+        done = (self.tima_base - self.div_base) // period
+        when = self.div_base + (done + 0x100 - self.tima) * period
+        self.sched.at(when, "timer", self._overflow)
+        # the run loop needs to know if that's sooner than it thinks
+        self.cpu._deadline = 0
+
+    def _overflow(self, when):
+        self.tima = self.io.mem[0x06]
+        self.tima_base = when
+        self.interrupt()
+        self._schedule()
+
+    def read_div(self):
+        return (self.now() - self.div_base) >> 8 & 0xFF
+
+    def read_tima(self):
+        ticks = self._ticks(self.tima_base, self.now())
+        left = 0x100 - self.tima
+        if ticks < left:
+            return self.tima + ticks
+        # overflowed and the event hasn't caught up yet
+        tma = self.io.mem[0x06]
+        return tma + (ticks - left) % (0x100 - tma)
+
+    def write_div(self, val):
+        self._rebase()
+        self.div_base = self.now()
+        self._schedule()
+
+    def write_tima(self, val):
+        self.tima = val
+        self.tima_base = self.now()
+        self._schedule()
+
+    def write_tma(self, val):
+        self.io.mem[0x06] = val
+
+    def write_tac(self, val):
+        self._rebase()
+        self.io.mem[0x07] = val & 0x07
+        self._schedule()
+